@@ -1,15 +1,51 @@
 #Import necessary libraries
 import os
 import io
+import sys
 import math
-import bcrypt
+import time
+import json
 import base64
+import bisect
+import argparse
+import importlib
+import sqlite3
+import tempfile
+import functools
+import threading
+import hmac
+import secrets
+import uuid
+from collections import deque, OrderedDict
 import mysql.connector as mysql
 from datetime import datetime, date, timedelta
-from PIL import Image, ImageDraw, ImageFont
 
 import streamlit as st
-import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access.
+
+    Keeps pandas, NumPy, PIL and bcrypt off the cold-start path: a worker only pays for
+    them once a page (or command) actually uses them.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+bcrypt = LazyModule("bcrypt")
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+Image = LazyModule("PIL.Image")
+ImageDraw = LazyModule("PIL.ImageDraw")
+ImageFont = LazyModule("PIL.ImageFont")
+# what bench-startup reports as loaded or not
+HEAVY_MODULES = ("bcrypt", "pandas", "numpy", "PIL.Image")
 
 # ===================== CONFIG =====================
 # Database config - update to your MySQL settings
@@ -20,13 +56,162 @@ DB_CONFIG = {
     "database": "parking"
 }
 
+# Connection pool settings (one pool per server process)
+DB_POOL_CONFIG = {
+    "pool_size": 5,                # connections kept open and reused
+    "max_overflow": 5,             # extra connections allowed during bursts
+    "checkout_timeout": 10.0,      # seconds to wait for a free connection
+    "health_check_interval": 30.0  # ping connections idle longer than this (seconds)
+}
+
+# Read replicas (optional): VPARK_REPLICAS=host1,host2 uses DB_CONFIG's credentials on each host.
+# The account needs the REPLICATION CLIENT privilege so replica lag can be checked.
+DB_REPLICAS = [dict(DB_CONFIG, host=h.strip()) for h in os.environ.get("VPARK_REPLICAS", "").split(",") if h.strip()]
+REPLICA_CONFIG = {
+    "max_lag_seconds": 5.0,            # replicas further behind than this are skipped
+    "lag_check_interval": 5.0,         # seconds between lag checks of a replica
+    "read_your_writes_seconds": 10.0   # after a session commits, its reads stay on the primary this long
+}
+
+# Where each read-only DB action may run: "replica" (if one is fresh enough) or "primary".
+# Anything not listed, every write and every read inside a booking transaction uses the primary.
+READ_ROUTING = {
+    "get_user": "replica",                       # also bounded by USER_CACHE_TTL
+    "reservations_for_user": "replica",
+    "reservations_page_for_user": "replica",
+    "pending_bills_for_user": "replica",
+    "get_reservation": "replica",
+    "get_overlapping_reserved_slots": "replica",  # display only; claim_slot re-checks on the primary
+    "occupancy_by_level": "replica",
+    "iter_paid_receipts": "replica",
+    "export_table": "replica",
+    "availability_timeline": "replica",          # display only, like the overlap query
+    "series_bookings": "replica"                 # suggestions only; reserve_series re-checks on the primary
+}
+
 # Image paths (change if needed). Use relative paths or URLs.
 BACKGROUND_IMAGE_PATH = "D:\\Skills Dev\\Python project\\Background.jpg"   # used on home page
 CAR_IMAGE_PATH = "D:\\Skills Dev\\Python project\\kindpng_76524.png"                 # shown on level selection or reservation
 
-# Parking configuration
-SLOTS_PER_LEVEL = 20
-LEVELS = [1, 2, 3]
+# Image assets are downscaled and re-encoded once per process (and again only when the file changes)
+ASSET_CONFIG = {
+    "format": "WEBP",                        # WEBP or JPEG (images with transparency fall back to PNG for JPEG)
+    "quality": 70,
+    "background_widths": [768, 1280, 1920],  # responsive background variants, in px
+    "inline_background_width": 1280,         # used when Streamlit static serving is off
+    "car_widths": [200, 400, 800]            # car image variants, in px
+}
+
+# Seconds a looked-up user profile stays cached inside a session
+USER_CACHE_TTL = 60.0
+
+# Change log shared by the server processes on this host (SQLite file). Workers read it to keep
+# their availability index and user caches in step with bookings made by other workers.
+SHARED_CACHE_CONFIG = {
+    "path": os.environ.get("VPARK_SHARED_CACHE", os.path.join(tempfile.gettempdir(), "vpark_changes.sqlite3")),
+    "keep_changes": 10000,  # changes kept; a worker further behind than this reloads everything
+    "min_pull_interval": 0.2   # seconds; lookups in between use what the last pull brought in
+}
+
+# Rows per page on the Account History page
+HISTORY_PAGE_SIZE = 20
+
+# Receipt rendering
+RECEIPT_CONFIG = {
+    "font_path": "arial.ttf",
+    "font_size": 20,
+    "workers": os.cpu_count() or 2,  # processes used by bulk receipt exports
+    "chunk_size": 500                # receipts fetched and rendered per batch
+}
+
+# Password hashing / login settings
+AUTH_CONFIG = {
+    "bcrypt_rounds": 12,       # cost for new hashes; stored hashes with another cost are rehashed on login
+    "workers": 4,              # threads running bcrypt (bcrypt releases the GIL)
+    "max_queue": 32,           # hash jobs allowed to wait for a worker before logins are turned away
+    "max_failures": 5,         # failed logins per user id inside the window before it is throttled
+    "failure_window": 300.0,   # seconds
+    "max_tracked_ids": 10000   # user ids with recent failures kept in memory; least recent dropped first
+}
+
+# Opt-in profiling of DB actions and pages: start the app with VPARK_PROFILE=1
+PROFILE_ENABLED = os.environ.get("VPARK_PROFILE", "0") == "1"
+
+# User ids allowed to open the admin pages (comma-separated in VPARK_ADMINS). Empty by default:
+# any user id can be claimed at signup, so roles only come from explicit configuration.
+ADMIN_USERS = set(u.strip() for u in os.environ.get("VPARK_ADMINS", "").split(",") if u.strip())
+
+# User ids that can open the operator occupancy dashboard (admins can too)
+OPERATOR_USERS = set(u.strip() for u in os.environ.get("VPARK_OPERATORS", "").split(",") if u.strip())
+
+# Bulk import/export (python VPARK_FINAL.py import-users / import-reservations / export)
+BULK_CONFIG = {
+    "batch_size": 2000,                    # rows per executemany + commit
+    "hash_workers": os.cpu_count() or 2    # processes hashing imported plain-text passwords
+}
+
+# Archival of finished history out of the hot reservations table
+ARCHIVE_CONFIG = {
+    "enabled": True,             # run the archiver thread inside the app
+    "keep_days": 90,             # finished reservations older than this (by exit time) are archived
+    "batch_size": 1000,          # rows moved per transaction
+    "interval_seconds": 3600     # how often the archiver thread wakes up
+}
+
+# Lifecycle sweeper: closes out reservations whose exit time has passed
+SWEEP_CONFIG = {
+    "enabled": True,             # run the sweeper thread inside the app
+    "interval_seconds": 300,     # how often the sweeper thread wakes up
+    "batch_size": 1000,          # rows updated per statement
+    "overdue_grace_minutes": 15  # unpaid bookings turn overdue this long after their exit time
+}
+
+# Gate / kiosk HTTP service (python VPARK_FINAL.py gate-server)
+# Every POST needs "Authorization: Bearer <token>": the gate's own token from VPARK_GATE_TOKENS
+# ("gate-1:token1,gate-2:token2") or the shared VPARK_GATE_SECRET. The server will not start without one.
+GATE_CONFIG = {
+    "host": os.environ.get("VPARK_GATE_HOST", "127.0.0.1"),   # put a TLS proxy in front before opening this up
+    "port": 8600,
+    "tokens": dict(item.strip().split(":", 1) for item in os.environ.get("VPARK_GATE_TOKENS", "").split(",") if ":" in item),
+    "secret": os.environ.get("VPARK_GATE_SECRET", ""),
+    "early_checkin_minutes": 30,   # a booking can be checked in this long before its entry time
+    "late_checkin_minutes": 0      # ... and until this long after its exit time
+}
+
+# Parking configuration: level -> [(slot size, count), ...], slots numbered from 1 in that order.
+# "S" slots take 2 wheelers, "M" up to 3 wheelers, "L" any vehicle. parking_slots is seeded from
+# this (or from the JSON file in VPARK_LOT_FILE, same shape: {"1": [["S", 100], ["L", 500]], ...})
+# and the app reads the lot layout back from parking_slots.
+LOT_CONFIG = {
+    1: [("L", 20)],
+    2: [("L", 20)],
+    3: [("L", 20)]
+}
+LOT_FILE = os.environ.get("VPARK_LOT_FILE")
+
+# "Reserve any suitable slot": which level the allocator fills first
+ALLOCATION_CONFIG = {
+    "policy": os.environ.get("VPARK_ALLOCATION_POLICY", "lowest_level"),  # lowest_level, pack or spread
+    "attempts": 5   # slots tried when concurrent bookings keep taking the pick
+}
+
+# Free-capacity timeline and alternative windows on the reservation page
+TIMELINE_CONFIG = {
+    "bucket_minutes": 15,   # timeline resolution
+    "horizon_hours": 24,    # length of the timeline around the requested window
+    "suggestions": 5        # alternative windows offered
+}
+
+# Recurring bookings (same slot on a daily or weekly pattern)
+RECURRING_CONFIG = {
+    "max_occurrences": 366   # longest series booked in one go
+}
+
+# Slot grid on the choose-slot page
+SLOT_GRID_CONFIG = {
+    "page_size": 50,   # slots per page
+    "columns": 10      # slots per row
+}
 
 # Rates (per hour)
 RATES = {
@@ -36,205 +221,2978 @@ RATES = {
 }
 
 # ===================== UTILITIES =====================
-def get_db_conn():
-    return mysql.connect(
-        host="localhost",
-        user="root",
-        password="12345678",
-        database="parking",
-        autocommit=True
-    )
-def init_db():
-    """Create required tables if they don't exist."""
-    conn = get_db_conn()
-    cur = conn.cursor()
-    # user_details table
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS user_details (
-        user_id VARCHAR(100) PRIMARY KEY,
-        user_name VARCHAR(255),
-        user_password VARBINARY(60),
-        user_addr VARCHAR(500),
-        vehicle_no VARCHAR(50),
-        user_mobile_no VARCHAR(20),
-        vehicle_type VARCHAR(20),
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-    # reservations table - one central table (better than per-user tables)
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS reservations (
-        reservation_id INT AUTO_INCREMENT PRIMARY KEY,
-        user_id VARCHAR(100),
-        level_no INT,
-        slot_no INT,
-        entry_datetime DATETIME,
-        exit_datetime DATETIME,
-        vehicle_type VARCHAR(20),
-        status VARCHAR(20) DEFAULT 'reserved', -- reserved, cancelled, paid, completed
-        bill_amount DOUBLE DEFAULT 0,
-        paid TINYINT(1) DEFAULT 0,
-        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES user_details(user_id)
-    )
-    """)
-    cur.close()
-    conn.close()
+class PooledConnection:
+    """Wrapper around a pooled MySQL connection. close() hands it back to the pool."""
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        cur = self._raw.cursor(*args, **kwargs)
+        if PROFILE_ENABLED:
+            return CountingCursor(cur, _profiler())
+        return cur
+
+    def commit(self):
+        self._raw.commit()
+        # this session just wrote: keep its reads on the primary until replicas catch up
+        pin_reads_to_primary()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._pool.release(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # safety net for code paths that raise before close(): the connection
+        # state is unknown, so drop it instead of putting it back
+        if not getattr(self, "_closed", True):
+            self._closed = True
+            self._pool.discard(self._raw)
+
+
+class ConnectionPool:
+    """Small thread-safe MySQL connection pool with checkout timeouts and health checks."""
+    def __init__(self, db_config, pool_size=5, max_overflow=0, checkout_timeout=10.0, health_check_interval=30.0):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = deque()   # (raw connection, last used monotonic time)
+        self._open = 0
+        self._in_use = 0
+        self._cond = threading.Condition(threading.RLock())
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+            "peak_in_use": 0
+        }
+
+    def _connect(self):
+        raw = mysql.connect(autocommit=True, **self.db_config)
+        with self._cond:
+            self._stats["connects"] += 1
+        return raw
+
+    def _healthy(self, raw):
+        try:
+            return raw.is_connected()
+        except mysql.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        raw, last_used, waited = None, None, False
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, last_used = self._idle.pop()
+                    break
+                if self._open < self.pool_size + self.max_overflow:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise mysql.errors.PoolError(
+                        f"No free database connection after {timeout:.1f}s "
+                        f"({self._open} open, pool_size={self.pool_size}, max_overflow={self.max_overflow})")
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._in_use)
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_seconds"] += time.monotonic() - start
+
+        try:
+            if raw is None:
+                raw = self._connect()
+            elif time.monotonic() - last_used > self.health_check_interval and not self._healthy(raw):
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                try:
+                    raw.close()
+                except mysql.Error:
+                    pass
+                raw = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw):
+        try:
+            # leave no half-finished transaction or unread rows for the next user
+            if raw.in_transaction:
+                raw.rollback()
+            raw.consume_results()
+        except mysql.Error:
+            self.discard(raw)
+            return
+        with self._cond:
+            self._in_use -= 1
+            if len(self._idle) >= self.pool_size:
+                # overflow connection: close it instead of keeping it around
+                self._open -= 1
+                to_close = raw
+            else:
+                self._idle.append((raw, time.monotonic()))
+                to_close = None
+            self._cond.notify()
+        if to_close is not None:
+            try:
+                to_close.close()
+            except mysql.Error:
+                pass
+
+    def discard(self, raw):
+        with self._cond:
+            self._in_use -= 1
+            self._open -= 1
+            self._stats["discarded"] += 1
+            self._cond.notify()
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._cond:
+            out = dict(self._stats)
+            out.update({
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use
+            })
+        return out
+
+
+class ReplicaSet:
+    """Connection pools for the read replicas, handed out round-robin to those that are not lagging.
+
+    Lag (Seconds_Behind_Source) is measured at most every lag_check_interval seconds per
+    replica; a replica that is too far behind, not replicating or unreachable is skipped
+    until its next check.
+    """
+    def __init__(self, db_configs, pool_config, max_lag_seconds=5.0, lag_check_interval=5.0):
+        self.pools = [ConnectionPool(c, **pool_config) for c in db_configs]
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_interval = lag_check_interval
+        self._lock = threading.Lock()
+        self._lag = [None] * len(self.pools)        # seconds behind, None = unknown or broken
+        self._checked = [None] * len(self.pools)    # monotonic time of the last check
+        self._next = 0
+        self._stats = {"replica_reads": 0, "primary_reads": 0, "pinned_reads": 0, "lag_fallbacks": 0}
+
+    def _measure(self, i):
+        conn = None
+        try:
+            conn = self.pools[i].acquire(timeout=1.0)
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+            except mysql.Error:
+                # before MySQL 8.0.22
+                cur.execute("SHOW SLAVE STATUS")
+            row = cur.fetchone()
+            cur.close()
+            if not row:
+                return None
+            lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+            return None if lag is None else float(lag)
+        except mysql.Error:
+            return None
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def lag(self, i):
+        now = time.monotonic()
+        with self._lock:
+            due = self._checked[i] is None or now - self._checked[i] >= self.lag_check_interval
+            if due:
+                self._checked[i] = now   # one thread measures, the others use the last value
+        if due:
+            lag = self._measure(i)
+            with self._lock:
+                self._lag[i] = lag
+        return self._lag[i]
+
+    def acquire(self):
+        """Connection to the next replica within max_lag_seconds, or None if there is none."""
+        for _ in range(len(self.pools)):
+            with self._lock:
+                i = self._next
+                self._next = (i + 1) % len(self.pools)
+            lag = self.lag(i)
+            if lag is not None and lag <= self.max_lag_seconds:
+                try:
+                    return self.pools[i].acquire()
+                except mysql.Error:
+                    continue
+        return None
+
+    def count(self, field):
+        with self._lock:
+            self._stats[field] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            lags = list(self._lag)
+        out["replicas"] = [{"host": pool.db_config["host"], "lag_seconds": lag, **pool.stats()}
+                           for pool, lag in zip(self.pools, lags)]
+        return out
+
+
+@st.cache_resource
+def _get_pool():
+    # cached so every rerun and every session in this process share one pool
+    return ConnectionPool(DB_CONFIG, **DB_POOL_CONFIG)
+
+@st.cache_resource
+def _replicas():
+    return ReplicaSet(DB_REPLICAS, DB_POOL_CONFIG, REPLICA_CONFIG["max_lag_seconds"], REPLICA_CONFIG["lag_check_interval"])
+
+def get_db_conn(read=None):
+    """Check out a connection from the process-wide pool. Call close() to return it.
+
+    `read` names the read-only function asking. If READ_ROUTING sends it to a replica, a
+    replica is within the lag limit and this session has not just written, the connection
+    comes from a replica; otherwise from the primary.
+    """
+    if read is not None and DB_REPLICAS and READ_ROUTING.get(read) == "replica":
+        replicas = _replicas()
+        if time.monotonic() < session_cache("_db_routing").get("primary_until", 0.0):
+            replicas.count("pinned_reads")
+        else:
+            conn = replicas.acquire()
+            if conn is not None:
+                replicas.count("replica_reads")
+                return conn
+            replicas.count("lag_fallbacks")
+        replicas.count("primary_reads")
+    return _get_pool().acquire()
+
+def pin_reads_to_primary():
+    """Send this session's routed reads to the primary for REPLICA_CONFIG["read_your_writes_seconds"]."""
+    if DB_REPLICAS:
+        session_cache("_db_routing")["primary_until"] = time.monotonic() + REPLICA_CONFIG["read_your_writes_seconds"]
+
+def pool_stats():
+    """Snapshot of connection pool counters (use it to size DB_POOL_CONFIG)."""
+    return _get_pool().stats()
+
+def replica_stats():
+    """Read routing counters and per-replica lag and pool counters (empty without replicas)."""
+    return _replicas().stats() if DB_REPLICAS else {}
 
 def hash_password(plain_password: str) -> bytes:
     """Return bcrypt hashed password (bytes)."""
-    return bcrypt.hashpw(plain_password.encode("utf-8"), bcrypt.gensalt())
+    return _auth_service().hash(plain_password)
 
 def check_password(plain_password, hashed):
     # hashed must be bytes
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed)
+    return _auth_service().verify(plain_password, hashed)
 
-def image_to_base64(path):
-    if not os.path.exists(path):
-        return None
-    with open(path, "rb") as f:
-        return base64.b64encode(f.read()).decode()
+# ===================== PROFILING =====================
+class CountingCursor:
+    """Cursor wrapper that reports executed statements and fetched rows to the profiler."""
+    def __init__(self, raw, profiler):
+        self._raw = raw
+        self._profiler = profiler
 
-# ===================== DB ACTIONS =====================
-def register_user(user_id, name, password, addr, vehicle_no, mobile, vehicle_type):
-    conn = get_db_conn()
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._raw.close()
+
+    def execute(self, *args, **kwargs):
+        self._profiler.add(queries=1)
+        return self._raw.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._profiler.add(queries=1)
+        return self._raw.executemany(*args, **kwargs)
+
+    def fetchone(self):
+        row = self._raw.fetchone()
+        if row is not None:
+            self._profiler.add(rows=1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._raw.fetchmany(*args, **kwargs)
+        self._profiler.add(rows=len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._raw.fetchall()
+        self._profiler.add(rows=len(rows))
+        return rows
+
+class Profiler:
+    """Call counts, query counts, rows fetched and wall time per function and per rerun.
+
+    Every instrumented call pushes a frame on a per-thread stack; queries and rows are
+    added to every open frame, so numbers are inclusive (a page includes its DB calls).
+    """
+    def __init__(self, keep_reruns=200):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._totals = {}   # (kind, name) -> counters
+        self._pages = {}    # page -> counters
+        self.recent = deque(maxlen=keep_reruns)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def add(self, queries=0, rows=0):
+        for frame in self._stack():
+            frame["queries"] += queries
+            frame["rows"] += rows
+
+    def call(self, kind, name, fn, args, kwargs):
+        stack = self._stack()
+        frame = {"queries": 0, "rows": 0}
+        stack.append(frame)
+        started = time.perf_counter()
+        error = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                t = self._totals.setdefault((kind, name), {"calls": 0, "seconds": 0.0, "queries": 0, "rows": 0, "errors": 0})
+                t["calls"] += 1
+                t["seconds"] += elapsed
+                t["queries"] += frame["queries"]
+                t["rows"] += frame["rows"]
+                t["errors"] += error
+            rerun = getattr(self._local, "rerun", None)
+            if rerun is not None:
+                c = rerun["calls"].setdefault(name, {"kind": kind, "calls": 0, "ms": 0.0, "queries": 0, "rows": 0})
+                c["calls"] += 1
+                c["ms"] += elapsed * 1000
+                c["queries"] += frame["queries"]
+                c["rows"] += frame["rows"]
+
+    def begin_rerun(self):
+        rerun = {"queries": 0, "rows": 0, "calls": {}, "started": time.perf_counter()}
+        self._local.rerun = rerun
+        self._stack()[:] = [rerun]
+
+    def end_rerun(self, page):
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is None:
+            return None
+        self._local.rerun = None
+        self._stack()[:] = []
+        record = {
+            "page": page,
+            "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "wall_ms": (time.perf_counter() - rerun["started"]) * 1000,
+            "queries": rerun["queries"],
+            "rows": rerun["rows"],
+            "calls": rerun["calls"]
+        }
+        with self._lock:
+            self.recent.append(record)
+            p = self._pages.setdefault(page, {"reruns": 0, "seconds": 0.0, "queries": 0, "rows": 0})
+            p["reruns"] += 1
+            p["seconds"] += record["wall_ms"] / 1000
+            p["queries"] += record["queries"]
+            p["rows"] += record["rows"]
+        return record
+
+    def totals(self):
+        with self._lock:
+            return {key: dict(v) for key, v in self._totals.items()}
+
+    def pages(self):
+        with self._lock:
+            return {page: dict(v) for page, v in self._pages.items()}
+
+@st.cache_resource
+def _profiler():
+    return Profiler()
+
+def instrumented(kind):
+    """Decorator for DB actions ("db") and pages ("page"); a no-op unless PROFILE_ENABLED."""
+    def wrap(fn):
+        if not PROFILE_ENABLED:
+            return fn
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            return _profiler().call(kind, name, fn, args, kwargs)
+        return inner
+    return wrap
+
+def prometheus_metrics():
+    """Profiler, pool, cache and auth counters in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    totals = _profiler().totals()
+    for field, kind, help_text in [("calls", "counter", "Instrumented function calls."),
+                                   ("seconds", "counter", "Wall time spent in instrumented functions."),
+                                   ("queries", "counter", "SQL statements executed inside instrumented functions."),
+                                   ("rows", "counter", "Rows fetched inside instrumented functions."),
+                                   ("errors", "counter", "Instrumented calls that raised.")]:
+        metric(f"vpark_function_{field}_total", kind, help_text,
+               [({"kind": k, "function": n}, v[field]) for (k, n), v in sorted(totals.items())])
+    pages = _profiler().pages()
+    for field, help_text in [("reruns", "Streamlit reruns per page."),
+                             ("seconds", "Wall time of reruns per page."),
+                             ("queries", "SQL statements per page across reruns."),
+                             ("rows", "Rows fetched per page across reruns.")]:
+        metric(f"vpark_page_{field}_total", "counter", help_text,
+               [({"page": page}, v[field]) for page, v in sorted(pages.items())])
+    pool = pool_stats()
+    for field in ("open", "idle", "in_use", "pool_size", "max_overflow"):
+        metric(f"vpark_db_pool_{field}", "gauge", f"Connection pool {field}.", [({}, pool[field])])
+    for field in ("checkouts", "waits", "wait_seconds", "timeouts", "connects", "discarded", "health_check_failures"):
+        metric(f"vpark_db_pool_{field}_total", "counter", f"Connection pool {field}.", [({}, pool[field])])
+    cache = user_cache_stats()
+    for field in ("hits", "misses", "invalidations"):
+        metric(f"vpark_user_cache_{field}_total", "counter", f"User profile cache {field}.", [({}, cache[field])])
+    for field, value in _auth_service().stats().items():
+        metric(f"vpark_auth_{field}_total", "counter", f"Auth service {field}.", [({}, value)])
+    routing = replica_stats()
+    if routing:
+        for field in ("replica_reads", "primary_reads", "pinned_reads", "lag_fallbacks"):
+            metric(f"vpark_db_{field}_total", "counter", f"Routed reads: {field}.", [({}, routing[field])])
+        metric("vpark_db_replica_lag_seconds", "gauge", "Last measured replica lag (-1 = unknown or broken).",
+               [({"replica": r["host"]}, -1 if r["lag_seconds"] is None else r["lag_seconds"]) for r in routing["replicas"]])
+        metric("vpark_db_replica_in_use", "gauge", "Replica pool connections in use.",
+               [({"replica": r["host"]}, r["in_use"]) for r in routing["replicas"]])
+    for field, value in shared_cache_stats().items():
+        if field == "last_seen":
+            metric("vpark_change_log_version", "gauge", "Last change version applied by this process.", [({}, value)])
+        else:
+            metric(f"vpark_change_log_{field}_total", "counter", f"Shared change log {field}.", [({}, value)])
+    sweep = _sweep_stats().stats()
+    metric("vpark_sweeper_runs_total", "counter", "Lifecycle sweeper runs.", [({}, sweep["runs"])])
+    metric("vpark_sweeper_skipped_total", "counter", "Sweeper runs skipped because another process was sweeping.", [({}, sweep["skipped"])])
+    metric("vpark_sweeper_seconds_total", "counter", "Wall time of sweeper runs.", [({}, sweep["seconds"])])
+    metric("vpark_sweeper_rows_total", "counter", "Reservations swept, by new status.",
+           [({"status": status}, sweep[status]) for status in ("completed", "overdue")])
+    metric("vpark_sweeper_last_rows", "gauge", "Reservations swept by the last run, by new status.",
+           [({"status": status}, sweep[f"last_{status}"]) for status in ("completed", "overdue")])
+    return "\n".join(lines) + "\n"
+
+# ===================== SCHEMA / MIGRATIONS =====================
+# Each entry: (version, description, [statements]). A statement is SQL text or a function
+# taking the cursor (for data backfills). Append new versions at the end, never edit one
+# that has already shipped.
+SCHEMA_MIGRATIONS = [
+    (1, "base tables", [
+        """
+        CREATE TABLE IF NOT EXISTS user_details (
+            user_id VARCHAR(100) PRIMARY KEY,
+            user_name VARCHAR(255),
+            user_password VARBINARY(60),
+            user_addr VARCHAR(500),
+            vehicle_no VARCHAR(50),
+            user_mobile_no VARCHAR(20),
+            vehicle_type VARCHAR(20),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # reservations table - one central table (better than per-user tables)
+        """
+        CREATE TABLE IF NOT EXISTS reservations (
+            reservation_id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(100),
+            level_no INT,
+            slot_no INT,
+            entry_datetime DATETIME,
+            exit_datetime DATETIME,
+            vehicle_type VARCHAR(20),
+            status VARCHAR(20) DEFAULT 'reserved', -- reserved, cancelled, paid, completed
+            bill_amount DOUBLE DEFAULT 0,
+            paid TINYINT(1) DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES user_details(user_id)
+        )
+        """
+    ]),
+    (2, "indexes for overlap, history and vehicle lookups", [
+        "CREATE INDEX idx_res_level_status_time ON reservations (level_no, status, entry_datetime, exit_datetime)",
+        "CREATE INDEX idx_res_user_created ON reservations (user_id, created_at)",
+        "CREATE INDEX idx_user_vehicle_no ON user_details (vehicle_no)"
+    ]),
+    (3, "parking_slots table (one lockable row per slot)", [
+        """
+        CREATE TABLE IF NOT EXISTS parking_slots (
+            level_no INT NOT NULL,
+            slot_no INT NOT NULL,
+            PRIMARY KEY (level_no, slot_no)
+        )
+        """
+    ]),
+    (4, "paid_at timestamp for receipts", [
+        "ALTER TABLE reservations ADD COLUMN paid_at DATETIME NULL",
+        "CREATE INDEX idx_res_paid_at ON reservations (paid_at)",
+        # rows paid before this column existed: entry time is the closest thing we have
+        "UPDATE reservations SET paid_at = entry_datetime WHERE paid=1 AND paid_at IS NULL"
+    ]),
+    (5, "hourly occupancy summary per level", [
+        """
+        CREATE TABLE IF NOT EXISTS occupancy_hourly (
+            level_no INT NOT NULL,
+            hour_start DATETIME NOT NULL,
+            reserved INT NOT NULL DEFAULT 0,  -- non-cancelled bookings overlapping the hour
+            paid INT NOT NULL DEFAULT 0,      -- of which paid
+            PRIMARY KEY (level_no, hour_start)
+        )
+        """,
+        lambda cur: backfill_occupancy(cur)
+    ]),
+    (6, "reservations_archive for finished history", [
+        # same columns and indexes as reservations (LIKE copies the current definition);
+        # future column changes to reservations must be applied to the archive too
+        "CREATE TABLE IF NOT EXISTS reservations_archive LIKE reservations",
+        "CREATE INDEX idx_res_status_exit ON reservations (status, exit_datetime)"
+    ]),
+    (7, "slot sizes", [
+        "ALTER TABLE parking_slots ADD COLUMN slot_size CHAR(1) NOT NULL DEFAULT 'L'"
+    ]),
+    (8, "gate check-in / check-out times", [
+        "ALTER TABLE reservations ADD COLUMN checked_in_at DATETIME NULL",
+        "ALTER TABLE reservations ADD COLUMN checked_out_at DATETIME NULL",
+        "ALTER TABLE reservations_archive ADD COLUMN checked_in_at DATETIME NULL",
+        "ALTER TABLE reservations_archive ADD COLUMN checked_out_at DATETIME NULL",
+        # gate lookups: a user's bookings around now
+        "CREATE INDEX idx_res_user_entry ON reservations (user_id, entry_datetime)"
+    ]),
+    (9, "normalized plates", [
+        # same rule as normalize_plate, so "ka 01-ab 1234" and "KA01AB1234" find the same user
+        "ALTER TABLE user_details ADD COLUMN vehicle_plate VARCHAR(50) "
+        "AS (UPPER(REPLACE(REPLACE(REPLACE(vehicle_no, ' ', ''), '-', ''), '.', ''))) STORED",
+        "CREATE INDEX idx_user_plate ON user_details (vehicle_plate)"
+    ])
+]
+
+# MySQL error codes that mean a statement was already applied (DDL is not transactional,
+# so a migration interrupted half-way must be safe to re-run)
+_ALREADY_APPLIED_ERRNOS = {
+    1050,  # table already exists
+    1060,  # duplicate column name
+    1061,  # duplicate key name
+    1826   # duplicate foreign key constraint name
+}
+
+def run_migrations(conn):
+    """Apply pending SCHEMA_MIGRATIONS in order and return the versions applied."""
     cur = conn.cursor()
+    applied = []
+    # serialize migrations across server processes
+    cur.execute("SELECT GET_LOCK('vpark_schema_migrations', 60)")
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        raise mysql.errors.OperationalError("Timed out waiting for the schema migration lock.")
     try:
-        # Hash password (bytes)
-        hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         cur.execute("""
-            INSERT INTO user_details (user_id,user_name,user_password,user_addr,vehicle_no,user_mobile_no,vehicle_type)
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-        """, (user_id, name, hashed_pw, addr, vehicle_no, mobile, vehicle_type))
-        conn.commit()
-        return True, None
-    except mysql.Error as e:
-        return False, str(e)
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cur.fetchone()[0]
+        for version, description, statements in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            for stmt in statements:
+                try:
+                    if callable(stmt):
+                        stmt(cur)
+                    else:
+                        cur.execute(stmt)
+                except mysql.Error as e:
+                    if e.errno not in _ALREADY_APPLIED_ERRNOS:
+                        raise
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s,%s)", (version, description))
+            applied.append(version)
+    finally:
+        cur.execute("SELECT RELEASE_LOCK('vpark_schema_migrations')")
+        cur.fetchall()
+        cur.close()
+    return applied
+
+def schema_version():
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    version = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return version
+
+def lot_config():
+    """Level -> [(slot size, count), ...] from VPARK_LOT_FILE if set, else LOT_CONFIG."""
+    if not LOT_FILE:
+        return LOT_CONFIG
+    with open(LOT_FILE) as f:
+        return {int(level): [tuple(r) for r in ranges] for level, ranges in json.load(f).items()}
+
+def seed_parking_slots(conn):
+    """Make sure every configured (level, slot) has its parking_slots row.
+
+    With VPARK_LOT_FILE the file also overrides slot sizes; without it rows that already
+    exist are left alone, so sizes edited in the database stick.
+    """
+    rows = []
+    for level, ranges in lot_config().items():
+        slot = 1
+        for size, count in ranges:
+            for _ in range(count):
+                rows.append((level, slot, size))
+                slot += 1
+    cur = conn.cursor()
+    if LOT_FILE:
+        cur.executemany("INSERT INTO parking_slots (level_no, slot_no, slot_size) VALUES (%s,%s,%s) "
+                        "ON DUPLICATE KEY UPDATE slot_size=VALUES(slot_size)", rows)
+    else:
+        cur.executemany("INSERT IGNORE INTO parking_slots (level_no, slot_no, slot_size) VALUES (%s,%s,%s)", rows)
+    cur.close()
+
+@instrumented("db")
+def init_db():
+    """Create or upgrade the schema to the latest migration."""
+    conn = get_db_conn()
+    try:
+        applied = run_migrations(conn)
+        seed_parking_slots(conn)
+        return applied
+    finally:
+        conn.close()
+
+@st.cache_resource
+def _ensure_schema():
+    # runs once per server process instead of on every rerun
+    # (a failure is not cached, so the next rerun retries)
+    init_db()
+    return True
+
+# Hot queries whose plans must stay index-backed. Sample parameters only need the right types.
+HOT_QUERIES = {
+    "overlapping_reserved_slots": (
+        "SELECT slot_no FROM reservations WHERE level_no=%s AND status IN ('reserved','paid') "
+        "AND entry_datetime < %s AND exit_datetime > %s",
+        (1, datetime(2030, 1, 1, 12), datetime(2030, 1, 1, 10))
+    ),
+    "reservations_page_for_user": (
+        "SELECT reservation_id FROM reservations WHERE user_id=%s "
+        "ORDER BY created_at DESC, reservation_id DESC LIMIT 21",
+        ("someone",)
+    ),
+    "pending_bills_for_user": (
+        "SELECT reservation_id FROM reservations WHERE user_id=%s AND paid=0 AND status IN ('reserved','overdue') "
+        "ORDER BY created_at DESC, reservation_id DESC",
+        ("someone",)
+    ),
+    "sweep_reservations": (
+        "SELECT reservation_id FROM reservations WHERE status='paid' AND exit_datetime < %s "
+        "ORDER BY exit_datetime, reservation_id LIMIT 1000",
+        (datetime(2030, 1, 1),)
+    ),
+    "get_user": (
+        "SELECT user_id FROM user_details WHERE user_id=%s",
+        ("someone",)
+    ),
+    "user_by_vehicle_no": (
+        "SELECT user_id FROM user_details WHERE vehicle_no=%s",
+        ("KA01AB1234",)
+    ),
+    "user_by_plate": (
+        "SELECT user_id FROM user_details WHERE vehicle_plate=%s LIMIT 1",
+        ("KA01AB1234",)
+    ),
+    "archive_batch": (
+        "SELECT reservation_id FROM reservations WHERE status=%s AND exit_datetime < %s "
+        "ORDER BY exit_datetime, reservation_id LIMIT %s",
+        ("completed", datetime(2030, 1, 1), 1000)
+    ),
+    "gate_active_reservation": (
+        "SELECT r.reservation_id FROM user_details u JOIN reservations r ON r.user_id = u.user_id "
+        "WHERE u.vehicle_plate=%s AND r.entry_datetime <= %s AND r.exit_datetime > %s "
+        "AND r.status IN ('reserved','paid') AND r.checked_in_at IS NULL ORDER BY r.entry_datetime LIMIT 1",
+        ("KA01AB1234", datetime(2030, 1, 1, 12), datetime(2030, 1, 1, 12))
+    ),
+    "availability_timeline": (
+        "SELECT level_no, slot_no, entry_datetime, exit_datetime FROM reservations "
+        "WHERE level_no IN (%s,%s,%s) AND status IN ('reserved','paid') AND entry_datetime < %s AND exit_datetime > %s",
+        (1, 2, 3, datetime(2030, 1, 2), datetime(2030, 1, 1))
+    )
+}
+
+def check_query_plans():
+    """EXPLAIN every HOT_QUERIES entry and return a list of problems (empty list = all indexed).
+
+    A plan is a problem when any table is read with a full table scan (type ALL) or a
+    full index scan (type index). Run it against a database with realistic data: on a
+    near-empty table the optimizer may legitimately prefer a scan.
+    """
+    conn = get_db_conn()
+    cur = conn.cursor(dictionary=True)
+    problems = []
+    try:
+        for name, (sql, params) in HOT_QUERIES.items():
+            cur.execute("EXPLAIN " + sql, params)
+            for row in cur.fetchall():
+                access = str(row.get("type") or "").upper()
+                if access in ("ALL", "INDEX"):
+                    problems.append(f"{name}: table {row.get('table')} uses a {access} scan (key={row.get('key')})")
     finally:
         cur.close()
         conn.close()
+    return problems
+
+# ===================== AVAILABILITY INDEX =====================
+# Statuses that occupy a slot
+ACTIVE_STATUSES = ("reserved", "paid")
+
+# Slot sizes, smallest first; a vehicle fits its own size and anything larger
+SLOT_SIZE_RANK = {"S": 0, "M": 1, "L": 2}
+
+def slot_size_for_vehicle(vehicle_type):
+    """Smallest slot size a vehicle type fits (matched like rate_for_vehicle_type)."""
+    key = str(vehicle_type).lower()
+    if "2" in key:
+        return "S"
+    elif "3" in key:
+        return "M"
+    return "L"
+
+def slot_fits(slot_size, vehicle_type):
+    return SLOT_SIZE_RANK.get(slot_size, SLOT_SIZE_RANK["L"]) >= SLOT_SIZE_RANK[slot_size_for_vehicle(vehicle_type)]
+
+def mask_slots(mask):
+    """Slot numbers set in a slot bitmask (bit n-1 is slot n), ascending."""
+    slots = []
+    while mask:
+        low = mask & -mask
+        slots.append(low.bit_length())
+        mask ^= low
+    return slots
+
+class LotTopology:
+    """Levels and slots of the garage. Slot sets are int bitmasks: bit n-1 stands for slot n."""
+    def __init__(self, rows):
+        self.slot_count = {}   # level -> highest slot number
+        size_masks = {}        # (level, size) -> mask
+        for level, slot, size in rows:
+            size = size if size in SLOT_SIZE_RANK else "L"
+            self.slot_count[level] = max(self.slot_count.get(level, 0), slot)
+            size_masks[(level, size)] = size_masks.get((level, size), 0) | (1 << (slot - 1))
+        self.levels = sorted(self.slot_count)
+        self.sizes = size_masks
+        self._fit_masks = {}   # (level, vehicle size) -> mask of slots that size fits in
+        for level in self.levels:
+            for vehicle_size, vehicle_rank in SLOT_SIZE_RANK.items():
+                self._fit_masks[(level, vehicle_size)] = functools.reduce(
+                    lambda acc, size: acc | size_masks.get((level, size), 0),
+                    [size for size, rank in SLOT_SIZE_RANK.items() if rank >= vehicle_rank], 0)
+
+    def slots_mask(self, level_no, vehicle_type=None):
+        """Slots on the level, only those vehicle_type fits in when given."""
+        size = slot_size_for_vehicle(vehicle_type) if vehicle_type else "S"
+        return self._fit_masks.get((level_no, size), 0)
+
+    def capacity(self, level_no, vehicle_type=None):
+        return self.slots_mask(level_no, vehicle_type).bit_count()
+
+    def slot_size(self, level_no, slot_no):
+        bit = 1 << (slot_no - 1)
+        return next((size for size in SLOT_SIZE_RANK if self.sizes.get((level_no, size), 0) & bit), None)
+
+@st.cache_resource
+def lot_topology():
+    # read once per process; restart the app after changing the lot layout
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT level_no, slot_no, slot_size FROM parking_slots")
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return LotTopology(rows)
+
+class AvailabilityIndex:
+    """In-memory copy of active bookings per (level, slot), kept in sync by the DB actions.
+
+    Every slot holds its bookings sorted by entry time together with a running maximum of
+    exit times, so "is the slot busy in [entry, exit)" is a single bisect. Busy slots of a
+    level for a window come back as a bitmask, which is cached until that level changes.
+    """
+    MASK_CACHE_SIZE = 256   # windows remembered per level
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.loaded_from = None   # bookings that ended before this were not loaded
+        self._lock = threading.RLock()
+        self._entries = {}    # (level, slot) -> [entry_dt, ...] sorted
+        self._bookings = {}   # (level, slot) -> [(entry_dt, exit_dt, reservation_id), ...] same order
+        self._max_exit = {}   # (level, slot) -> running max of exit_dt over _bookings
+        self._where = {}      # reservation_id -> (level, slot)
+        self._booked = {}     # level -> {slots with at least one booking}
+        self._masks = {}      # level -> {(entry_dt, exit_dt): busy mask}
+
+    def load(self, rows, loaded_from):
+        """Replace the contents with (reservation_id, level, slot, entry, exit) rows."""
+        with self._lock:
+            self._entries, self._bookings, self._max_exit, self._where = {}, {}, {}, {}
+            self._booked, self._masks = {}, {}
+            self.loaded_from = loaded_from
+            for rid, level, slot, entry_dt, exit_dt in sorted(rows, key=lambda r: r[3]):
+                key = (level, slot)
+                self._entries.setdefault(key, []).append(entry_dt)
+                self._bookings.setdefault(key, []).append((entry_dt, exit_dt, rid))
+                self._where[rid] = key
+                self._booked.setdefault(level, set()).add(slot)
+            for key in self._bookings:
+                self._rebuild_max(key, 0)
+
+    def _rebuild_max(self, key, start):
+        bookings = self._bookings[key]
+        max_exit = self._max_exit.setdefault(key, [])
+        del max_exit[start:]
+        running = max_exit[start - 1] if start > 0 else None
+        for _, exit_dt, _ in bookings[start:]:
+            running = exit_dt if running is None or exit_dt > running else running
+            max_exit.append(running)
+
+    def add(self, reservation_id, level_no, slot_no, entry_dt, exit_dt):
+        with self._lock:
+            if reservation_id in self._where:
+                return
+            key = (level_no, slot_no)
+            entries = self._entries.setdefault(key, [])
+            pos = bisect.bisect_right(entries, entry_dt)
+            entries.insert(pos, entry_dt)
+            self._bookings.setdefault(key, []).insert(pos, (entry_dt, exit_dt, reservation_id))
+            self._where[reservation_id] = key
+            self._rebuild_max(key, pos)
+            self._booked.setdefault(level_no, set()).add(slot_no)
+            self._masks.pop(level_no, None)
+
+    def remove(self, reservation_id):
+        with self._lock:
+            key = self._where.pop(reservation_id, None)
+            if key is None:
+                return
+            bookings = self._bookings[key]
+            pos = next(i for i, b in enumerate(bookings) if b[2] == reservation_id)
+            del bookings[pos]
+            del self._entries[key][pos]
+            self._rebuild_max(key, pos)
+            if not bookings:
+                self._booked[key[0]].discard(key[1])
+            self._masks.pop(key[0], None)
+
+    def set_status(self, reservation_id, status):
+        # reserved -> paid keeps the slot occupied; anything else frees it
+        if status not in ACTIVE_STATUSES:
+            self.remove(reservation_id)
+
+    def covers(self, entry_dt):
+        return self.loaded_from is not None and entry_dt >= self.loaded_from
+
+    def is_busy(self, level_no, slot_no, entry_dt, exit_dt):
+        key = (level_no, slot_no)
+        entries = self._entries.get(key)
+        if not entries:
+            return False
+        # bookings [0, pos) start before exit_dt; busy if any of them ends after entry_dt
+        pos = bisect.bisect_left(entries, exit_dt)
+        return pos > 0 and self._max_exit[key][pos - 1] > entry_dt
+
+    def busy_mask(self, level_no, entry_dt, exit_dt):
+        """Bitmask of the level's slots that are booked somewhere in [entry_dt, exit_dt)."""
+        with self._lock:
+            masks = self._masks.setdefault(level_no, {})
+            mask = masks.get((entry_dt, exit_dt))
+            if mask is None:
+                mask = 0
+                # only slots that have bookings at all need a look
+                for slot in self._booked.get(level_no, ()):
+                    if self.is_busy(level_no, slot, entry_dt, exit_dt):
+                        mask |= 1 << (slot - 1)
+                if len(masks) >= self.MASK_CACHE_SIZE:
+                    masks.clear()
+                masks[(entry_dt, exit_dt)] = mask
+            return mask
+
+    def bookings_by_slot(self):
+        """Snapshot {(level, slot): [(entry_dt, exit_dt), ...]} of every slot with bookings."""
+        with self._lock:
+            return {key: [(b[0], b[1]) for b in bookings] for key, bookings in self._bookings.items() if bookings}
+
+    def busy_slots(self, level_no, entry_dt, exit_dt):
+        return set(mask_slots(self.busy_mask(level_no, entry_dt, exit_dt)))
+
+    def free_masks(self, entry_dt, exit_dt, vehicle_type=None):
+        """Return {level: free slot mask} for every level, only slots vehicle_type fits in when given."""
+        return {level: self.topology.slots_mask(level, vehicle_type) & ~self.busy_mask(level, entry_dt, exit_dt)
+                for level in self.topology.levels}
+
+
+@st.cache_resource
+def _availability():
+    # built once per process from the active bookings that have not ended yet;
+    # afterwards it is updated incrementally by the DB actions below and by changes other
+    # workers publish (the change log is opened first, so nothing published during the
+    # load is missed; re-applying a change is harmless)
+    _change_log()
+    loaded_from = datetime.combine(date.today(), datetime.min.time())
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime FROM reservations
+        WHERE status IN ('reserved','paid') AND exit_datetime > %s
+    """, (loaded_from,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    index = AvailabilityIndex(lot_topology())
+    index.load(rows, loaded_from)
+    return index
+
+@instrumented("db")
+def free_slot_masks(entry_dt, exit_dt, vehicle_type=None, consistent=False):
+    """Return {level: free slot mask} for [entry_dt, exit_dt) across all levels.
+
+    With vehicle_type only slots big enough for it are counted as free. consistent=True
+    keeps the database fallback on the primary.
+    """
+    sync_shared_changes()
+    index = _availability()
+    if index.covers(entry_dt):
+        return index.free_masks(entry_dt, exit_dt, vehicle_type)
+    # window starts before what the index holds: ask the database
+    topology = lot_topology()
+    free = {}
+    for level in topology.levels:
+        busy = 0
+        for slot in get_overlapping_reserved_slots(level, entry_dt, exit_dt, consistent):
+            busy |= 1 << (slot - 1)
+        free[level] = topology.slots_mask(level, vehicle_type) & ~busy
+    return free
+
+def free_slots_by_level(entry_dt, exit_dt, vehicle_type=None):
+    """Return {level: [free slot numbers]} for [entry_dt, exit_dt) across all levels."""
+    return {level: mask_slots(mask) for level, mask in free_slot_masks(entry_dt, exit_dt, vehicle_type).items()}
+
+# ===================== CACHES =====================
+_thread_state = threading.local()
+
+def session_cache(name):
+    """Dict that lives as long as the current session.
+
+    Inside the Streamlit app that is st.session_state; outside it (CLI commands,
+    benchmarks) every thread acts as its own session.
+    """
+    if get_script_run_ctx() is not None:
+        if name not in st.session_state:
+            st.session_state[name] = {}
+        return st.session_state[name]
+    caches = getattr(_thread_state, "caches", None)
+    if caches is None:
+        caches = _thread_state.caches = {}
+    return caches.setdefault(name, {})
+
+class UserCacheRegistry:
+    """Process-wide side of the user profile cache: per-user versions and hit/miss counters.
+
+    The profiles themselves are cached in each session (session_cache), so a session only
+    ever holds profiles it looked up itself. Bumping a user's version makes every
+    session's copy stale at once.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._epoch = 0   # bumped to make every cached profile stale
+        self._versions = {}
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def version(self, user_id):
+        return self._epoch, self._versions.get(user_id, 0)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._stats["invalidations"] += 1
+
+    def invalidate_all(self):
+        with self._lock:
+            self._epoch += 1
+            self._stats["invalidations"] += 1
+
+    def record(self, hit):
+        with self._lock:
+            self._stats["hits" if hit else "misses"] += 1
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        lookups = out["hits"] + out["misses"]
+        out["hit_ratio"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+@st.cache_resource
+def _user_cache_registry():
+    return UserCacheRegistry()
+
+def invalidate_user(user_id, publish=True):
+    """Drop cached copies of a user's profile in every session (call after any profile change).
+
+    publish=False only touches this process (when the change is announced some other way).
+    """
+    _user_cache_registry().invalidate(user_id)
+    if publish:
+        publish_change("user", user_id=user_id)
+
+def user_cache_stats():
+    return _user_cache_registry().stats()
+
+# ===================== SHARED CHANGE LOG =====================
+class ChangeLog:
+    """Change feed shared by the server processes on this host, stored in a SQLite file.
+
+    Writes that other workers must know about append a row; its rowid is the change version,
+    which only ever grows. A worker compares the version it has seen with MAX(version)
+    (one index lookup) and applies just the newer changes to its in-memory caches instead
+    of re-querying MySQL.
+    """
+    def __init__(self, path, keep_changes=10000):
+        self.keep_changes = keep_changes
+        # not the pid: workers in separate containers sharing the file often have the same one.
+        # Prefixed so a column created as INTEGER by an older version never coerces it to a number.
+        self.origin = "w" + uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                origin TEXT NOT NULL,      -- ChangeLog.origin of the writing process
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+        """)
+        self._stats = {"published": 0, "pulls": 0, "applied": 0, "full_reloads": 0, "skipped": 0}
+        self.last_seen = self.version()
+        self._pull_lock = threading.Lock()
+        self._last_pull_at = float("-inf")
+
+    def due(self, interval):
+        """True for at most one caller per `interval` seconds; the rest skip the pull."""
+        now = time.monotonic()
+        with self._pull_lock:
+            if now - self._last_pull_at < interval:
+                self._stats["skipped"] += 1
+                return False
+            self._last_pull_at = now
+            return True
+
+    def version(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+
+    def publish(self, kind, payload):
+        with self._lock:
+            version = self._db.execute("INSERT INTO changes (origin, kind, payload) VALUES (?,?,?)",
+                                       (self.origin, kind, json.dumps(payload, default=str))).lastrowid
+            if version % 1000 == 0:
+                self._db.execute("DELETE FROM changes WHERE version <= ?", (version - self.keep_changes,))
+            self._stats["published"] += 1
+        return version
+
+    def pull(self):
+        """Changes by other processes since the last pull, as (changes, complete).
+
+        complete is False when changes this worker never saw were already pruned; the
+        caller must then rebuild its caches from the database.
+        """
+        with self._lock:
+            latest = self._db.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+            if latest <= self.last_seen:
+                return [], True
+            self._stats["pulls"] += 1
+            oldest = self._db.execute("SELECT MIN(version) FROM changes").fetchone()[0]
+            rows = self._db.execute("SELECT version, kind, payload FROM changes WHERE version > ? AND origin <> ? ORDER BY version",
+                                    (self.last_seen, self.origin)).fetchall()
+            complete = oldest is not None and oldest <= self.last_seen + 1
+            self.last_seen = max([latest] + [r[0] for r in rows])
+            self._stats["applied"] += len(rows)
+            if not complete:
+                self._stats["full_reloads"] += 1
+        return [(kind, json.loads(payload)) for _, kind, payload in rows], complete
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, last_seen=self.last_seen)
+
+@st.cache_resource
+def _change_log():
+    return ChangeLog(SHARED_CACHE_CONFIG["path"], SHARED_CACHE_CONFIG["keep_changes"])
+
+def publish_change(kind, **payload):
+    """Tell the other workers about a committed write. MySQL stays the source of truth, so a
+    failure here is logged and does not undo the write."""
+    try:
+        _change_log().publish(kind, payload)
+    except sqlite3.Error as e:
+        print(f"[vpark change log] {e}", file=sys.stderr)
+
+def sync_shared_changes():
+    """Apply other workers' changes to this process's availability index and user cache.
+
+    Runs at most every SHARED_CACHE_CONFIG["min_pull_interval"] seconds, so busy pages do
+    not queue up on the change log's connection.
+    """
+    log = _change_log()
+    if not log.due(SHARED_CACHE_CONFIG["min_pull_interval"]):
+        return
+    try:
+        changes, complete = log.pull()
+    except sqlite3.Error as e:
+        print(f"[vpark change log] {e}", file=sys.stderr)
+        return
+    if not complete:
+        # too far behind: rebuild from the database on next use
+        _availability.clear()
+        _user_cache_registry().invalidate_all()
+        return
+    for kind, change in changes:
+        if kind == "reservation":
+            _availability().add(change["reservation_id"], change["level_no"], change["slot_no"],
+                                datetime.fromisoformat(change["entry_datetime"]), datetime.fromisoformat(change["exit_datetime"]))
+        elif kind == "status":
+            index = _availability()
+            for rid in change["reservation_ids"]:
+                index.set_status(rid, change["status"])
+        elif kind == "user":
+            invalidate_user(change["user_id"], publish=False)
+        elif kind == "users":
+            _user_cache_registry().invalidate_all()
+        elif kind == "series":
+            index = _availability()
+            for rid, entry_dt, exit_dt in change["reservations"]:
+                index.add(rid, change["level_no"], change["slot_no"], datetime.fromisoformat(entry_dt), datetime.fromisoformat(exit_dt))
+        elif kind == "reservations":
+            _availability.clear()
+
+def shared_cache_stats():
+    return _change_log().stats()
+
+# ===================== AUTH =====================
+class AuthBusy(Exception):
+    """Raised when too many password hash jobs are already queued."""
+
+class AuthService:
+    """Runs bcrypt in a bounded worker pool and throttles repeated login failures per user id."""
+    def __init__(self, bcrypt_rounds=12, workers=4, max_queue=32, max_failures=5, failure_window=300.0,
+                 max_tracked_ids=10000):
+        from concurrent.futures import ThreadPoolExecutor
+        self.bcrypt_rounds = bcrypt_rounds
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.max_tracked_ids = max_tracked_ids
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vpark-bcrypt")
+        # running + waiting jobs; a full semaphore means the queue is full
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._dummy_hash = None
+        self._failures = OrderedDict()   # user_id -> deque of failure times, least recent failure first
+        self._stats = {"hashes": 0, "verifies": 0, "rejected_busy": 0, "throttled": 0, "rehashed": 0}
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected_busy"] += 1
+            raise AuthBusy("Server is busy, please try again in a moment.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, plain_password):
+        rounds = self.bcrypt_rounds
+        with self._lock:
+            self._stats["hashes"] += 1
+        return self._run(lambda: bcrypt.hashpw(plain_password.encode("utf-8"), bcrypt.gensalt(rounds)))
+
+    def verify(self, plain_password, hashed):
+        with self._lock:
+            self._stats["verifies"] += 1
+        return self._run(bcrypt.checkpw, plain_password.encode("utf-8"), hashed)
+
+    def dummy_hash(self):
+        """Hash of a random password at the configured cost, checked for unknown user ids."""
+        with self._lock:
+            if self._dummy_hash is None:
+                self._dummy_hash = bcrypt.hashpw(secrets.token_bytes(16).hex().encode("utf-8"), bcrypt.gensalt(self.bcrypt_rounds))
+            return self._dummy_hash
+
+    def needs_rehash(self, hashed):
+        try:
+            return int(hashed.split(b"$")[2]) != self.bcrypt_rounds
+        except (IndexError, ValueError):
+            return False
+
+    def _recent_failures(self, user_id):
+        # caller holds self._lock; ids whose failures all aged out are forgotten
+        failures = self._failures.get(user_id)
+        if failures is None:
+            return None
+        cutoff = time.monotonic() - self.failure_window
+        while failures and failures[0] < cutoff:
+            failures.popleft()
+        if not failures:
+            del self._failures[user_id]
+            return None
+        return failures
+
+    def is_throttled(self, user_id):
+        with self._lock:
+            failures = self._recent_failures(user_id)
+            throttled = failures is not None and len(failures) >= self.max_failures
+            if throttled:
+                self._stats["throttled"] += 1
+            return throttled
+
+    def record_result(self, user_id, ok):
+        with self._lock:
+            if ok:
+                self._failures.pop(user_id, None)
+                return
+            failures = self._recent_failures(user_id)
+            if failures is None:
+                failures = self._failures[user_id] = deque()
+            failures.append(time.monotonic())
+            self._failures.move_to_end(user_id)
+            # guessing random ids must not grow this without bound
+            while len(self._failures) > self.max_tracked_ids:
+                self._failures.popitem(last=False)
+
+    def record_rehash(self):
+        with self._lock:
+            self._stats["rehashed"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+@st.cache_resource
+def _auth_service():
+    return AuthService(**AUTH_CONFIG)
+
+@instrumented("db")
+def login(user_id, password):
+    """Check credentials. Returns (ok, error message or None).
+
+    Failed attempts are throttled per user id, and a stored hash made with a different
+    bcrypt cost than AUTH_CONFIG["bcrypt_rounds"] is replaced after a successful login.
+    """
+    service = _auth_service()
+    if service.is_throttled(user_id):
+        return False, "Too many failed attempts. Please wait a few minutes and try again."
+    user = get_user(user_id)
+    try:
+        if user is None:
+            # same bcrypt work as a real account, so timing does not tell which ids exist
+            service.verify(password, service.dummy_hash())
+            ok = False
+        else:
+            ok = service.verify(password, user["password_hash"])
+    except AuthBusy as e:
+        return False, str(e)
+    service.record_result(user_id, ok)
+    if not ok:
+        return False, "Invalid credentials"
+    if service.needs_rehash(user["password_hash"]):
+        try:
+            update_password_hash(user_id, service.hash(password))
+            service.record_rehash()
+        except (AuthBusy, mysql.Error):
+            pass   # keep the old hash; we'll try again on the next login
+    return True, None
+
+# ===================== DB ACTIONS =====================
+@instrumented("db")
+def register_user(user_id, name, password, addr, vehicle_no, mobile, vehicle_type):
+    # Hash password (bytes) before taking a connection from the pool
+    try:
+        hashed_pw = hash_password(password)
+    except AuthBusy as e:
+        return False, str(e)
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            INSERT INTO user_details (user_id,user_name,user_password,user_addr,vehicle_no,user_mobile_no,vehicle_type)
+            VALUES (%s,%s,%s,%s,%s,%s,%s)
+        """, (user_id, name, hashed_pw, addr, vehicle_no, mobile, vehicle_type))
+        conn.commit()
+        invalidate_user(user_id)
+        return True, None
+    except mysql.IntegrityError as e:
+        # taken by another session since user_exists looked
+        if e.errno == 1062:
+            return False, "User ID already exists"
+        return False, str(e)
+    except mysql.Error as e:
+        return False, str(e)
+    finally:
+        cur.close()
+        conn.close()
+
+@instrumented("db")
+def get_user(user_id):
+    """Return the user's profile dict (or None), cached per session for USER_CACHE_TTL seconds."""
+    registry = _user_cache_registry()
+    cache = session_cache("_user_cache")
+    version = registry.version(user_id)
+    entry = cache.get(user_id)
+    if entry and entry[0] > time.monotonic() and entry[1] == version:
+        registry.record(True)
+        return dict(entry[2])
+    registry.record(False)
+    user = load_user(user_id)
+    # misses are not cached, so an account created elsewhere is visible immediately
+    if user is not None:
+        cache[user_id] = (time.monotonic() + USER_CACHE_TTL, version, user)
+        return dict(user)
+    return None
+
+@instrumented("db")
+def load_user(user_id):
+    conn = get_db_conn(read="get_user")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT user_id,user_name,user_password,user_addr,vehicle_no,user_mobile_no,vehicle_type
+        FROM user_details WHERE user_id=%s
+    """, (user_id,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not row:
+        return None
+    # Ensure password is bytes
+    password_hash = row[2]
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode("utf-8")  # convert to bytes
+    return {
+        "user_id": row[0],
+        "name": row[1],
+        "password_hash": password_hash,  # now definitely bytes
+        "address": row[3],
+        "vehicle_no": row[4],
+        "mobile_no": row[5],
+        "vehicle_type": row[6]
+    }
+                    
+@instrumented("db")
+def user_exists(user_id):
+    """Primary-only check for signup: a replica may not have an account created moments ago."""
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM user_details WHERE user_id=%s", (user_id,))
+    found = cur.fetchone() is not None
+    cur.close()
+    conn.close()
+    return found
+
+@instrumented("db")
+def authenticate_user(user_id, password):
+    return login(user_id, password)[0]
+
+@instrumented("db")
+def update_password_hash(user_id, hashed_pw):
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("UPDATE user_details SET user_password=%s WHERE user_id=%s", (hashed_pw, user_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+    invalidate_user(user_id)
+
+@instrumented("db")
+def claim_slot(user_id, level_no, slot_no, entry_dt, exit_dt, vehicle_type, bill_amount=0.0):
+    """Atomically book a slot for [entry_dt, exit_dt).
+
+    The slot's parking_slots row is locked for the length of the transaction, so
+    concurrent claims for the same slot run one after another and only the first one
+    finds the window empty. Returns (ok, reservation_id, alternative) where alternative
+    is the nearest free (level, slot) when the claim lost, or None.
+    """
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        conn.start_transaction(isolation_level="READ COMMITTED")
+        cur.execute("SELECT slot_size FROM parking_slots WHERE level_no=%s AND slot_no=%s FOR UPDATE", (level_no, slot_no))
+        row = cur.fetchone()
+        taken = True
+        # a slot too small for the vehicle counts as taken
+        if row is not None and slot_fits(row[0], vehicle_type):
+            cur.execute("""
+                SELECT COUNT(*) FROM reservations
+                WHERE level_no=%s AND slot_no=%s AND status IN ('reserved','paid')
+                AND entry_datetime < %s AND exit_datetime > %s
+            """, (level_no, slot_no, exit_dt, entry_dt))
+            taken = cur.fetchone()[0] > 0
+        if taken:
+            conn.rollback()
+            reservation_id = None
+        else:
+            cur.execute("""
+                INSERT INTO reservations (user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, bill_amount, status, paid)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,'reserved',0)
+            """, (user_id, level_no, slot_no, entry_dt, exit_dt, vehicle_type, bill_amount))
+            reservation_id = cur.lastrowid
+            apply_occupancy(cur, [(level_no, entry_dt, exit_dt)], reserved=1)
+            conn.commit()
+    except mysql.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    if reservation_id is None:
+        return False, None, nearest_free_slot(level_no, slot_no, entry_dt, exit_dt, vehicle_type)
+    _availability().add(reservation_id, level_no, slot_no, entry_dt, exit_dt)
+    publish_change("reservation", reservation_id=reservation_id, level_no=level_no, slot_no=slot_no,
+                   entry_datetime=entry_dt.isoformat(), exit_datetime=exit_dt.isoformat())
+    return True, reservation_id, None
+
+def nearest_free_slot(level_no, slot_no, entry_dt, exit_dt, vehicle_type=None):
+    """Closest free (level, slot) to the requested one: same level first, then nearer levels."""
+    free = free_slot_masks(entry_dt, exit_dt, vehicle_type, consistent=True)
+    for level in sorted(free, key=lambda l: (abs(l - level_no), l)):
+        mask = free[level]
+        if level == level_no:
+            mask &= ~(1 << (slot_no - 1))
+        elif mask >> (slot_no - 1) & 1:
+            return level, slot_no
+        # highest free slot below slot_no and lowest free slot above it
+        below = (mask & ((1 << (slot_no - 1)) - 1)).bit_length()
+        above_bits = mask >> slot_no
+        above = slot_no + (above_bits & -above_bits).bit_length() if above_bits else 0
+        if below and (not above or slot_no - below <= above - slot_no):
+            return level, below
+        if above:
+            return level, above
+    return None
+
+# Placement policies: pick a level from {level: free slot mask} (levels with no free slot excluded)
+ALLOCATION_POLICIES = {
+    # lowest level that has room
+    "lowest_level": lambda free: min(free),
+    # fullest level that still has room, so whole levels stay empty
+    "pack": lambda free: min(free, key=lambda level: (free[level].bit_count(), level)),
+    # emptiest level, so load is spread evenly
+    "spread": lambda free: max(free, key=lambda level: (free[level].bit_count(), -level))
+}
+# checked once here: a misspelt VPARK_ALLOCATION_POLICY stops the app at startup instead of
+# failing every booking
+if ALLOCATION_CONFIG["policy"] not in ALLOCATION_POLICIES:
+    raise ValueError(f"Unknown allocation policy {ALLOCATION_CONFIG['policy']!r} (VPARK_ALLOCATION_POLICY); "
+                     f"expected one of: {', '.join(ALLOCATION_POLICIES)}")
+
+@instrumented("db")
+def allocate_slot(user_id, entry_dt, exit_dt, vehicle_type, bill_amount=0.0, policy=None):
+    """Book any free slot that fits vehicle_type for [entry_dt, exit_dt).
+
+    The level comes from the placement policy (ALLOCATION_CONFIG["policy"] by default) and
+    the slot is the lowest free one on it, both read straight off the free-slot bitmasks.
+    Returns (ok, reservation_id, (level, slot)); (False, None, None) when nothing fits.
+    """
+    pick_level = ALLOCATION_POLICIES[policy or ALLOCATION_CONFIG["policy"]]
+    free = {level: mask for level, mask in free_slot_masks(entry_dt, exit_dt, vehicle_type, consistent=True).items() if mask}
+    for _ in range(ALLOCATION_CONFIG["attempts"]):
+        if not free:
+            break
+        level = pick_level(free)
+        slot_no = (free[level] & -free[level]).bit_length()
+        ok, reservation_id, _ = claim_slot(user_id, level, slot_no, entry_dt, exit_dt, vehicle_type, bill_amount)
+        if ok:
+            return True, reservation_id, (level, slot_no)
+        # someone else got it first: drop it and pick again
+        free[level] &= ~(1 << (slot_no - 1))
+        if not free[level]:
+            del free[level]
+    return False, None, None
+
+WEEKDAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+def recurrence_windows(start_date, end_date, entry_time, exit_time, weekdays=None):
+    """Entry and exit datetime64 arrays for each day in [start_date, end_date].
+
+    weekdays (Mon=0) limits the series to those days of the week; None means every day.
+    An exit time at or before the entry time ends on the next day.
+    """
+    days = np.arange(np.datetime64(start_date, "D"), np.datetime64(end_date, "D") + 1)
+    if weekdays is not None:
+        # day 0 of the epoch was a Thursday
+        days = days[np.isin((days.astype(np.int64) + 3) % 7, list(weekdays))]
+    entry_offset = np.timedelta64(entry_time.hour * 60 + entry_time.minute, "m")
+    exit_offset = np.timedelta64(exit_time.hour * 60 + exit_time.minute, "m")
+    if exit_offset <= entry_offset:
+        exit_offset += np.timedelta64(1, "D")
+    return (days + entry_offset).astype("datetime64[s]"), (days + exit_offset).astype("datetime64[s]")
+
+def series_conflicts(entries, exits, busy_entries, busy_exits):
+    """Boolean array: which [entries[i], exits[i]) windows overlap a busy interval.
+
+    The busy intervals are sorted once; searchsorted finds, for every window at once, the
+    busy intervals that start before it ends, and a running maximum of their exits tells
+    whether any of them is still running at its entry.
+    """
+    if len(busy_entries) == 0:
+        return np.zeros(len(entries), dtype=bool)
+    order = np.argsort(busy_entries, kind="stable")
+    starts = busy_entries[order]
+    latest_exit = np.maximum.accumulate(busy_exits[order])
+    before = np.searchsorted(starts, exits, side="left")
+    return (before > 0) & (latest_exit[np.maximum(before - 1, 0)] > entries)
+
+def series_free_masks(entries, exits, vehicle_type=None):
+    """{level: mask of the slots free in every window of a series}.
+
+    One pass over the availability index (or one bulk query when the series starts before
+    what the index holds): each booked slot checks all windows at once with series_conflicts.
+    """
+    entries = np.asarray(entries, dtype="datetime64[s]")
+    exits = np.asarray(exits, dtype="datetime64[s]")
+    topology = lot_topology()
+    sync_shared_changes()
+    index = _availability()
+    if index.covers(entries.min().tolist()):
+        bookings = index.bookings_by_slot()
+    else:
+        bookings = series_bookings(entries.min().tolist(), exits.max().tolist())
+    busy = {level: 0 for level in topology.levels}
+    for (level, slot), windows in bookings.items():
+        if level not in busy:
+            continue
+        clash = series_conflicts(entries, exits, np.array([w[0] for w in windows], dtype="datetime64[s]"),
+                                 np.array([w[1] for w in windows], dtype="datetime64[s]"))
+        if clash.any():
+            busy[level] |= 1 << (slot - 1)
+    return {level: topology.slots_mask(level, vehicle_type) & ~busy[level] for level in topology.levels}
+
+@instrumented("db")
+def series_bookings(start_dt, end_dt):
+    """Active bookings overlapping [start_dt, end_dt) as {(level, slot): [(entry, exit), ...]}, in one query."""
+    conn = get_db_conn(read="series_bookings")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT level_no, slot_no, entry_datetime, exit_datetime FROM reservations
+        WHERE status IN ('reserved','paid') AND entry_datetime < %s AND exit_datetime > %s
+    """, (end_dt, start_dt))
+    bookings = {}
+    for level, slot, entry_dt, exit_dt in cur.fetchall():
+        bookings.setdefault((level, slot), []).append((entry_dt, exit_dt))
+    cur.close()
+    conn.close()
+    return bookings
+
+@instrumented("db")
+def reserve_series(user_id, level_no, slot_no, entries, exits, vehicle_type, skip_conflicts=False):
+    """Book one slot for every window of a recurring series in a single transaction.
+
+    Like claim_slot the slot's parking_slots row is locked, then all windows are checked
+    against the slot's bookings with one query and series_conflicts, priced together with
+    compute_costs_bulk and inserted with one executemany. A clash books nothing unless
+    skip_conflicts, which books the free windows only. Returns (ok, booked, conflicts):
+    booked is [(reservation_id, entry, exit, amount)], conflicts the entry datetimes that clashed.
+    """
+    entries = np.asarray(entries, dtype="datetime64[s]")
+    exits = np.asarray(exits, dtype="datetime64[s]")
+    if len(entries) == 0:
+        return False, [], []
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        conn.start_transaction(isolation_level="READ COMMITTED")
+        cur.execute("SELECT slot_size FROM parking_slots WHERE level_no=%s AND slot_no=%s FOR UPDATE", (level_no, slot_no))
+        row = cur.fetchone()
+        if row is None or not slot_fits(row[0], vehicle_type):
+            conn.rollback()
+            return False, [], entries.tolist()
+        # one query for the whole span of the series
+        cur.execute("""
+            SELECT entry_datetime, exit_datetime FROM reservations
+            WHERE level_no=%s AND slot_no=%s AND status IN ('reserved','paid')
+            AND entry_datetime < %s AND exit_datetime > %s
+        """, (level_no, slot_no, exits.max().tolist(), entries.min().tolist()))
+        busy = cur.fetchall()
+        clash = series_conflicts(entries, exits, np.array([b[0] for b in busy], dtype="datetime64[s]"),
+                                 np.array([b[1] for b in busy], dtype="datetime64[s]"))
+        conflicts = entries[clash].tolist()
+        if clash.all() or (clash.any() and not skip_conflicts):
+            conn.rollback()
+            return False, [], conflicts
+        entries, exits = entries[~clash], exits[~clash]
+        amounts, _ = compute_costs_bulk([vehicle_type] * len(entries), entries, exits)
+        entry_list, exit_list = entries.tolist(), exits.tolist()
+        cur.executemany("""
+            INSERT INTO reservations (user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, bill_amount, status, paid)
+            VALUES (%s,%s,%s,%s,%s,%s,%s,'reserved',0)
+        """, [(user_id, level_no, slot_no, e, x, vehicle_type, float(a)) for e, x, a in zip(entry_list, exit_list, amounts)])
+        # read the new ids back under the same lock (multi-row inserts need not get consecutive ids)
+        cur.execute("""
+            SELECT reservation_id, entry_datetime FROM reservations
+            WHERE level_no=%s AND slot_no=%s AND user_id=%s AND status='reserved'
+            AND entry_datetime >= %s AND entry_datetime <= %s
+        """, (level_no, slot_no, user_id, entry_list[0], entry_list[-1]))
+        ids = {entry_dt: rid for rid, entry_dt in cur.fetchall()}
+        apply_occupancy(cur, [(level_no, e, x) for e, x in zip(entry_list, exit_list)], reserved=1)
+        conn.commit()
+    except mysql.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    booked = [(ids[e], e, x, float(a)) for e, x, a in zip(entry_list, exit_list, amounts)]
+    index = _availability()
+    for rid, entry_dt, exit_dt, _ in booked:
+        index.add(rid, level_no, slot_no, entry_dt, exit_dt)
+    # one change for the whole series rather than one per booking
+    publish_change("series", level_no=level_no, slot_no=slot_no,
+                   reservations=[[rid, e.isoformat(), x.isoformat()] for rid, e, x, _ in booked])
+    return True, booked, conflicts
+
+@instrumented("db")
+def reservations_for_user(user_id):
+    """Full history of a user, hot and archived, newest first."""
+    conn = get_db_conn(read="reservations_for_user")
+    cols = "reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, bill_amount, paid, created_at"
+    df = pd.read_sql(f"SELECT {cols} FROM reservations WHERE user_id=%s "
+                     f"UNION ALL SELECT {cols} FROM reservations_archive WHERE user_id=%s "
+                     "ORDER BY created_at DESC, reservation_id DESC",
+                     conn, params=(user_id, user_id))
+    conn.close()
+    return df.drop(columns=["created_at"])
+
+@instrumented("db")
+def reservations_page_for_user(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    """One page of a user's history, hot and archived, newest first (keyset pagination).
+
+    `before` is the cursor returned for the previous page. Returns (df, next_cursor);
+    next_cursor is None on the last page.
+    """
+    part = ("(SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, bill_amount, paid, created_at "
+            "FROM {table} WHERE user_id=%s")
+    part_params = [user_id]
+    if before is not None:
+        part += " AND (created_at < %s OR (created_at = %s AND reservation_id < %s))"
+        part_params += [before[0], before[0], before[1]]
+    part += " ORDER BY created_at DESC, reservation_id DESC LIMIT %s)"
+    part_params.append(limit + 1)
+    # each side uses its own (user_id, created_at) index; only 2 x (limit + 1) rows are merged
+    sql = (part.format(table="reservations") + " UNION ALL " + part.format(table="reservations_archive")
+           + " ORDER BY created_at DESC, reservation_id DESC LIMIT %s")
+    params = part_params * 2 + [limit + 1]
+    conn = get_db_conn(read="reservations_page_for_user")
+    df = pd.read_sql(sql, conn, params=tuple(params))
+    conn.close()
+    next_cursor = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        next_cursor = (pd.Timestamp(last["created_at"]).to_pydatetime(), int(last["reservation_id"]))
+    return df.drop(columns=["created_at"]), next_cursor
+
+@instrumented("db")
+def pending_bills_for_user(user_id):
+    """Unpaid (reserved or overdue) reservations of a user with their amount due, priced in SQL like compute_cost."""
+    conn = get_db_conn(read="pending_bills_for_user")
+    cur = conn.cursor(dictionary=True)
+    cur.execute("""
+        SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, hours,
+               GREATEST(1, hours) * CASE WHEN LOCATE('2', vehicle_type) > 0 THEN %s
+                                         WHEN LOCATE('3', vehicle_type) > 0 THEN %s
+                                         ELSE %s END AS amount
+        FROM (
+            SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, created_at,
+                   CEIL(TIMESTAMPDIFF(SECOND, entry_datetime, exit_datetime) / 3600) AS hours
+            FROM reservations
+            WHERE user_id=%s AND paid=0 AND status IN ('reserved','overdue')
+        ) AS pending
+        ORDER BY created_at DESC, reservation_id DESC
+    """, (RATES["2 wheeler"], RATES["3 wheeler"], RATES["4 wheeler"], user_id))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    for row in rows:
+        row["hours"] = int(row["hours"])
+        row["amount"] = float(row["amount"])
+    return rows
+
+@instrumented("db")
+def get_reservation(reservation_id, user_id):
+    conn = get_db_conn(read="get_reservation")
+    cur = conn.cursor(dictionary=True)
+    row = None
+    for table in ("reservations", "reservations_archive"):
+        cur.execute(f"""
+            SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, bill_amount, paid
+            FROM {table} WHERE reservation_id=%s AND user_id=%s
+        """, (reservation_id, user_id))
+        row = cur.fetchone()
+        if row:
+            break
+    cur.close()
+    conn.close()
+    return row
+
+@instrumented("db")
+def get_overlapping_reserved_slots(level_no, entry_dt, exit_dt, consistent=False):
+    """Return set of slot numbers in `level_no` that overlap with given period and not cancelled.
+
+    consistent=True reads from the primary (for decisions made right before booking).
+    """
+    conn = get_db_conn(read=None if consistent else "get_overlapping_reserved_slots")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT slot_no FROM reservations
+        WHERE level_no=%s AND status IN ('reserved','paid') AND entry_datetime < %s AND exit_datetime > %s
+    """, (level_no, exit_dt, entry_dt))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return set(r[0] for r in rows)
+
+def rate_for_vehicle_type(vehicle_type):
+    """Hourly rate for a vehicle type string ("2 wheeler", "3-wheeler", "car", ...)."""
+    key = str(vehicle_type).lower()
+    if "2" in key:
+        return RATES["2 wheeler"]
+    elif "3" in key:
+        return RATES["3 wheeler"]
+    return RATES["4 wheeler"]
+
+def compute_cost(vehicle_type, entry_dt, exit_dt):
+    seconds = (exit_dt - entry_dt).total_seconds()
+    hours = math.ceil(seconds / 3600)
+    rate = rate_for_vehicle_type(vehicle_type)
+    return rate * max(1, hours), hours
+
+def compute_costs_bulk(vehicle_types, entries, exits):
+    """Vectorized compute_cost: returns (amounts, hours) NumPy arrays for whole columns.
+
+    The rate of each distinct vehicle type is resolved once into a lookup table and
+    gathered by code, so the per-row work is plain array arithmetic. Results match
+    compute_cost row for row.
+    """
+    codes, uniques = pd.factorize(pd.Series(vehicle_types, dtype=object), use_na_sentinel=False)
+    rate_table = np.array([rate_for_vehicle_type(v) for v in uniques], dtype=np.float64)
+    entries = pd.to_datetime(pd.Series(entries)).to_numpy(dtype="datetime64[ns]")
+    exits = pd.to_datetime(pd.Series(exits)).to_numpy(dtype="datetime64[ns]")
+    seconds = (exits - entries) / np.timedelta64(1, "s")
+    hours = np.ceil(seconds / 3600).astype(np.int64)
+    amounts = rate_table[codes] * np.maximum(1, hours)
+    return amounts, hours
+
+def price_reservations(df):
+    """Return a copy of a reservations DataFrame with `amount` and `hours` columns added."""
+    out = df.copy()
+    out["amount"], out["hours"] = compute_costs_bulk(df["vehicle_type"], df["entry_datetime"], df["exit_datetime"])
+    return out
+
+@instrumented("db")
+def mark_reservation_paid(reservation_id, amount):
+    """Mark one pending reservation paid. Returns False if it is gone, cancelled or already paid."""
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        cur.execute("SELECT level_no, entry_datetime, exit_datetime, status FROM reservations WHERE reservation_id=%s FOR UPDATE", (reservation_id,))
+        row = cur.fetchone()
+        if row is None or row[3] not in ("reserved", "overdue"):
+            # a cancelled slot may have been booked by someone else since
+            conn.rollback()
+            return False
+        cur.execute("UPDATE reservations SET paid=1, bill_amount=%s, status='paid', paid_at=NOW() WHERE reservation_id=%s", (amount, reservation_id))
+        apply_occupancy(cur, [row[:3]], paid=1)
+        conn.commit()
+    except mysql.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    _availability().set_status(reservation_id, "paid")
+    publish_change("status", reservation_ids=[reservation_id], status="paid")
+    return True
+
+@instrumented("db")
+def settle_reservations(user_id, reservation_ids):
+    """Pay several pending reservations of a user in one transaction.
+
+    The rows are locked, priced in one compute_costs_bulk pass and marked paid with a
+    single UPDATE. Reservations that are no longer pending are skipped. Returns
+    (settled, paid_at) where settled is a list of {reservation_id, hours, amount} dicts;
+    settled is empty when nothing was left to pay.
+    """
+    if not reservation_ids:
+        return [], None
+    marks = ",".join(["%s"] * len(reservation_ids))
+    paid_at = datetime.now().replace(microsecond=0)
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        # primary key order keeps lock order consistent with other settlements
+        cur.execute(f"""
+            SELECT reservation_id, level_no, entry_datetime, exit_datetime, vehicle_type FROM reservations
+            WHERE user_id=%s AND reservation_id IN ({marks}) AND paid=0 AND status IN ('reserved','overdue')
+            ORDER BY reservation_id FOR UPDATE
+        """, (user_id, *reservation_ids))
+        rows = cur.fetchall()
+        if not rows:
+            conn.rollback()
+            return [], None
+        amounts, hours = compute_costs_bulk([r[4] for r in rows], [r[2] for r in rows], [r[3] for r in rows])
+        settled = [{"reservation_id": r[0], "hours": int(h), "amount": float(a)} for r, a, h in zip(rows, amounts, hours)]
+        ids = [b["reservation_id"] for b in settled]
+        cases = " ".join(["WHEN %s THEN %s"] * len(settled))
+        cur.execute(f"""
+            UPDATE reservations SET paid=1, status='paid', paid_at=%s,
+                   bill_amount = CASE reservation_id {cases} END
+            WHERE reservation_id IN ({",".join(["%s"] * len(ids))})
+        """, (paid_at, *[v for b in settled for v in (b["reservation_id"], b["amount"])], *ids))
+        apply_occupancy(cur, [r[1:4] for r in rows], paid=1)
+        conn.commit()
+    except mysql.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+    index = _availability()
+    for rid in ids:
+        index.set_status(rid, "paid")
+    publish_change("status", reservation_ids=ids, status="paid")
+    return settled, paid_at
+
+@instrumented("db")
+def cancel_reservation_db(reservation_id, user_id):
+    """Cancel only if the reservation belongs to the user and entry_datetime is in future and status reserved."""
+    conn = get_db_conn()
+    cur = conn.cursor()
+    # verify conditions (row stays locked until commit; returning early rolls back via close())
+    conn.start_transaction()
+    cur.execute("SELECT entry_datetime, status, level_no, exit_datetime FROM reservations WHERE reservation_id=%s AND user_id=%s FOR UPDATE", (reservation_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        conn.close()
+        return False, "Reservation not found."
+    entry_dt, status = row[0], row[1]
+    if status != "reserved":
+        cur.close()
+        conn.close()
+        return False, "Only reserved reservations can be cancelled."
+    if entry_dt <= datetime.now():
+        cur.close()
+        conn.close()
+        return False, "Cannot cancel a reservation whose entry time has passed or is ongoing."
+    cur.execute("UPDATE reservations SET status='cancelled' WHERE reservation_id=%s", (reservation_id,))
+    apply_occupancy(cur, [(row[2], entry_dt, row[3])], reserved=-1)
+    conn.commit()
+    cur.close()
+    conn.close()
+    _availability().set_status(reservation_id, "cancelled")
+    publish_change("status", reservation_ids=[reservation_id], status="cancelled")
+    return True, None
+
+# ===================== OCCUPANCY =====================
+# occupancy_hourly holds, per level and clock hour, how many bookings overlap that hour.
+# Every write path adjusts it in the same transaction as the reservation row, so dashboard
+# queries read levels x hours summary rows and never touch the reservations table.
+_OCCUPANCY_UPSERT = """
+    INSERT INTO occupancy_hourly (level_no, hour_start, reserved, paid) VALUES (%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE reserved = reserved + VALUES(reserved), paid = paid + VALUES(paid)
+"""
+
+def hours_spanned(entry_dt, exit_dt):
+    """Start of every clock hour that overlaps [entry_dt, exit_dt)."""
+    hour = entry_dt.replace(minute=0, second=0, microsecond=0)
+    hours = []
+    while hour < exit_dt:
+        hours.append(hour)
+        hour += timedelta(hours=1)
+    return hours
+
+def occupancy_deltas(bookings, reserved=0, paid=0):
+    """Sum per-(level, hour) changes for (level_no, entry_dt, exit_dt) bookings into upsert rows."""
+    totals = {}
+    for level_no, entry_dt, exit_dt in bookings:
+        for hour in hours_spanned(entry_dt, exit_dt):
+            r, p = totals.get((level_no, hour), (0, 0))
+            totals[(level_no, hour)] = (r + reserved, p + paid)
+    return [(level_no, hour, r, p) for (level_no, hour), (r, p) in totals.items()]
+
+def apply_occupancy(cur, bookings, reserved=0, paid=0):
+    rows = occupancy_deltas(bookings, reserved, paid)
+    if rows:
+        cur.executemany(_OCCUPANCY_UPSERT, rows)
+
+def delete_reservations(cur, where, params):
+    """Delete the reservations matching `where` and take them back out of occupancy_hourly.
+
+    For throwaway rows such as benchmark data; run it inside a transaction. Returns the
+    deleted reservation ids.
+    """
+    cur.execute(f"SELECT reservation_id, level_no, entry_datetime, exit_datetime, status, paid FROM reservations WHERE {where} FOR UPDATE", params)
+    rows = cur.fetchall()
+    live = [row for row in rows if row[4] != "cancelled"]
+    apply_occupancy(cur, [row[1:4] for row in live], reserved=-1)
+    apply_occupancy(cur, [row[1:4] for row in live if row[5]], paid=-1)
+    cur.execute(f"DELETE FROM reservations WHERE {where}", params)
+    return [row[0] for row in rows]
+
+def backfill_occupancy(cur, chunk_size=5000):
+    """Rebuild occupancy_hourly from the reservations table (used by the migration)."""
+    cur.execute("""
+        SELECT level_no, entry_datetime, exit_datetime, paid FROM reservations
+        WHERE status <> 'cancelled' AND entry_datetime IS NOT NULL AND exit_datetime IS NOT NULL
+    """)
+    # aggregate while streaming; the summary is levels x hours, far smaller than the history
+    totals = {}
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        for level_no, entry_dt, exit_dt, paid in rows:
+            for hour in hours_spanned(entry_dt, exit_dt):
+                r, p = totals.get((level_no, hour), (0, 0))
+                totals[(level_no, hour)] = (r + 1, p + (1 if paid else 0))
+    cur.execute("DELETE FROM occupancy_hourly")
+    items = [(level_no, hour, r, p) for (level_no, hour), (r, p) in totals.items()]
+    for i in range(0, len(items), chunk_size):
+        cur.executemany(_OCCUPANCY_UPSERT, items[i:i + chunk_size])
+
+@instrumented("db")
+def occupancy_by_level(start_dt, end_dt):
+    """Occupancy per level and hour for [start_dt, end_dt), read only from occupancy_hourly.
+
+    Returns a DataFrame with hour_start, level_no, reserved, paid, capacity and
+    occupancy_pct, with a row for every level/hour even when nothing was booked.
+    """
+    start_dt = start_dt.replace(minute=0, second=0, microsecond=0)
+    topology = lot_topology()
+    conn = get_db_conn(read="occupancy_by_level")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT level_no, hour_start, reserved, paid FROM occupancy_hourly
+        WHERE level_no IN ({}) AND hour_start >= %s AND hour_start < %s
+    """.format(",".join(["%s"] * len(topology.levels))), (*topology.levels, start_dt, end_dt))
+    found = {(r[0], r[1]): (r[2], r[3]) for r in cur.fetchall()}
+    cur.close()
+    conn.close()
+    rows = []
+    for hour in hours_spanned(start_dt, end_dt):
+        for level in topology.levels:
+            reserved, paid = found.get((level, hour), (0, 0))
+            capacity = topology.capacity(level)
+            rows.append({"hour_start": hour, "level_no": level, "reserved": reserved, "paid": paid,
+                         "capacity": capacity, "occupancy_pct": 100.0 * reserved / capacity})
+    return pd.DataFrame(rows)
+
+def is_operator(user_id):
+    return user_id in OPERATOR_USERS or user_id in ADMIN_USERS
+
+# ===================== AVAILABILITY TIMELINE =====================
+# Free slots per level in fixed buckets over a horizon, from one fetch of the overlapping
+# bookings. A booking marks every bucket it touches, so a slot shown free in a bucket is
+# free for the whole bucket and suggested windows can be booked as they are.
+def _busy_buckets(start_dt, buckets, bucket_minutes, vehicle_type):
+    """(levels, level_starts, busy) for slots vehicle_type fits in, one row per slot.
+
+    Rows are grouped by level (level_starts[i] is the first row of levels[i]); busy[r, b]
+    is True when slot r has a booking overlapping bucket b.
+    """
+    topology = lot_topology()
+    end_dt = start_dt + timedelta(minutes=bucket_minutes * buckets)
+    levels, level_starts, row_slots = [], [], []
+    for level in topology.levels:
+        slots = mask_slots(topology.slots_mask(level, vehicle_type))
+        if slots:
+            levels.append(level)
+            level_starts.append(len(row_slots))
+            row_slots.extend((level, slot) for slot in slots)
+    busy = np.zeros((len(row_slots), buckets), dtype=bool)
+    if not row_slots:
+        return levels, level_starts, busy
+
+    conn = get_db_conn(read="availability_timeline")
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT level_no, slot_no, entry_datetime, exit_datetime FROM reservations
+        WHERE level_no IN ({}) AND status IN ('reserved','paid') AND entry_datetime < %s AND exit_datetime > %s
+    """.format(",".join(["%s"] * len(levels))), (*levels, end_dt, start_dt))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    if not rows:
+        return levels, level_starts, busy
+
+    # (level, slot) -> row through a flat lookup table; bookings on slots that don't fit are dropped
+    stride = max(slot for _, slot in row_slots) + 1
+    lookup = np.full((max(levels) + 1) * stride, -1, dtype=np.int64)
+    lookup[[level * stride + slot for level, slot in row_slots]] = np.arange(len(row_slots))
+    bookings = pd.DataFrame(rows, columns=["level_no", "slot_no", "entry_datetime", "exit_datetime"])
+    slot_nos = bookings["slot_no"].to_numpy(dtype=np.int64)
+    keys = bookings["level_no"].to_numpy(dtype=np.int64) * stride + slot_nos
+    in_range = (slot_nos < stride) & (keys < len(lookup))
+    row = np.where(in_range, lookup[np.where(in_range, keys, 0)], -1)
+    keep = row >= 0
+    bucket = np.timedelta64(bucket_minutes, "m")
+    origin = np.datetime64(start_dt, "ns")
+    entries = pd.to_datetime(bookings["entry_datetime"]).to_numpy(dtype="datetime64[ns]")[keep]
+    exits = pd.to_datetime(bookings["exit_datetime"]).to_numpy(dtype="datetime64[ns]")[keep]
+    first = np.clip(np.floor((entries - origin) / bucket), 0, buckets).astype(np.int64)
+    last = np.clip(np.ceil((exits - origin) / bucket), 0, buckets).astype(np.int64)
+    # +1 where a booking starts, -1 where it ends; a running sum along time counts bookings
+    diff = np.zeros((len(row_slots), buckets + 1), dtype=np.int32)
+    np.add.at(diff, (row[keep], first), 1)
+    np.add.at(diff, (row[keep], last), -1)
+    busy = np.cumsum(diff[:, :buckets], axis=1) > 0
+    return levels, level_starts, busy
+
+@instrumented("db")
+def availability_timeline(entry_dt, exit_dt, vehicle_type=None, horizon_hours=None, bucket_minutes=None, suggestions=None):
+    """Free-capacity timeline around a requested window plus the nearest bookable windows.
+
+    Returns (timeline, windows). timeline is a DataFrame with bucket_start, level_no, free
+    and capacity for every level and bucket of the horizon (which starts no earlier than
+    now). windows lists up to `suggestions` dicts with entry_dt, exit_dt, free (slots
+    free for the whole window) and best_level, nearest to entry_dt first.
+    """
+    bucket_minutes = bucket_minutes or TIMELINE_CONFIG["bucket_minutes"]
+    horizon_hours = horizon_hours or TIMELINE_CONFIG["horizon_hours"]
+    suggestions = TIMELINE_CONFIG["suggestions"] if suggestions is None else suggestions
+    bucket = timedelta(minutes=bucket_minutes)
+
+    def floor(dt):
+        return dt.replace(second=0, microsecond=0) - timedelta(minutes=dt.minute % bucket_minutes)
+
+    start_dt = max(floor(datetime.now()), floor(entry_dt) - timedelta(hours=horizon_hours / 2))
+    buckets = int(horizon_hours * 60 // bucket_minutes)
+    levels, level_starts, busy = _busy_buckets(start_dt, buckets, bucket_minutes, vehicle_type)
+    bucket_starts = [start_dt + i * bucket for i in range(buckets)]
+    if not levels:
+        return pd.DataFrame(columns=["bucket_start", "level_no", "free", "capacity"]), []
+
+    capacity = np.diff(level_starts + [busy.shape[0]])
+    free = np.add.reduceat(~busy, level_starts, axis=0).astype(np.int64)   # levels x buckets
+    timeline = pd.DataFrame({
+        "bucket_start": np.tile(bucket_starts, len(levels)),
+        "level_no": np.repeat(levels, buckets),
+        "free": free.ravel(),
+        "capacity": np.repeat(capacity, buckets)
+    })
+
+    # slots free for every bucket of a window of the requested length starting at bucket b
+    length = max(1, math.ceil((exit_dt - entry_dt) / bucket))
+    windows = []
+    if length <= buckets:
+        busy_before = np.zeros((busy.shape[0], buckets + 1), dtype=np.int32)
+        np.cumsum(busy, axis=1, out=busy_before[:, 1:])
+        window_free = np.add.reduceat((busy_before[:, length:] - busy_before[:, :-length]) == 0, level_starts, axis=0)
+        total = window_free.sum(axis=0)
+        now = datetime.now()
+        candidates = [b for b in np.flatnonzero(total) if bucket_starts[b] >= now]
+        candidates.sort(key=lambda b: (abs(bucket_starts[b] - entry_dt), bucket_starts[b]))
+        for b in candidates[:suggestions]:
+            windows.append({
+                "entry_dt": bucket_starts[b],
+                "exit_dt": bucket_starts[b] + (exit_dt - entry_dt),
+                "free": int(total[b]),
+                "best_level": int(levels[int(np.argmax(window_free[:, b]))])
+            })
+    return timeline, windows
+
+# ===================== ARCHIVAL =====================
+# Finished reservations (completed, cancelled or paid, with exit time older than
+# ARCHIVE_CONFIG["keep_days"]) move to reservations_archive so the overlap and pending-bill
+# queries only see recent and future rows. History, receipts and exports read both tables.
+# (MySQL range partitioning was not an option: partitioned InnoDB tables cannot have the
+# user_id foreign key, and every unique key would have to include entry_datetime.)
+ARCHIVE_COLUMNS = ("reservation_id, user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, "
+                   "status, bill_amount, paid, created_at, paid_at, checked_in_at, checked_out_at")
+
+ARCHIVABLE_STATUSES = ("completed", "cancelled", "paid")
+
+def archive_reservations(keep_days=None, batch_size=None):
+    """Move finished reservations older than keep_days into the archive, batch by batch.
+
+    Only one process archives at a time (MySQL named lock); if another one holds it this
+    returns None straight away. Otherwise returns the number of rows moved.
+    """
+    keep_days = ARCHIVE_CONFIG["keep_days"] if keep_days is None else keep_days
+    batch_size = batch_size or ARCHIVE_CONFIG["batch_size"]
+    cutoff = datetime.now() - timedelta(days=keep_days)
+    conn = get_db_conn()
+    cur = conn.cursor()
+    moved = 0
+    cur.execute("SELECT GET_LOCK('vpark_archiver', 0)")
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        conn.close()
+        return None
+    try:
+        for status in ARCHIVABLE_STATUSES:
+            moved += _archive_status(conn, cur, status, cutoff, batch_size)
+    finally:
+        cur.execute("SELECT RELEASE_LOCK('vpark_archiver')")
+        cur.fetchall()
+        cur.close()
+        conn.close()
+    return moved
+
+def _archive_status(conn, cur, status, cutoff, batch_size):
+    moved = 0
+    while True:
+        conn.start_transaction()
+        # one status at a time and in (status, exit_datetime) index order, so InnoDB reads
+        # and locks only the batch instead of sorting every match
+        cur.execute("""
+            SELECT reservation_id FROM reservations
+            WHERE status=%s AND exit_datetime < %s
+            ORDER BY exit_datetime, reservation_id LIMIT %s FOR UPDATE
+        """, (status, cutoff, batch_size))
+        ids = [row[0] for row in cur.fetchall()]
+        if not ids:
+            conn.rollback()
+            break
+        marks = ",".join(["%s"] * len(ids))
+        cur.execute(f"INSERT INTO reservations_archive ({ARCHIVE_COLUMNS}) "
+                    f"SELECT {ARCHIVE_COLUMNS} FROM reservations WHERE reservation_id IN ({marks})", ids)
+        cur.execute(f"DELETE FROM reservations WHERE reservation_id IN ({marks})", ids)
+        conn.commit()
+        moved += len(ids)
+        index = _availability()
+        for rid in ids:
+            index.remove(rid)
+        if len(ids) < batch_size:
+            break
+    return moved
+
+def _archiver_loop():
+    while True:
+        try:
+            archive_reservations()
+        except Exception as e:
+            print(f"[vpark archiver] {e}", file=sys.stderr)
+        time.sleep(ARCHIVE_CONFIG["interval_seconds"])
+
+@st.cache_resource
+def _start_archiver():
+    # one background thread per process; the named lock keeps processes from overlapping
+    if not ARCHIVE_CONFIG["enabled"]:
+        return None
+    thread = threading.Thread(target=_archiver_loop, name="vpark-archiver", daemon=True)
+    thread.start()
+    return thread
+
+# ===================== LIFECYCLE SWEEPER =====================
+# Once exit time has passed, paid bookings become 'completed' and unpaid ones 'overdue'
+# (still owed, so they stay in the pending bills). Both keep their occupancy_hourly counts:
+# the slot was taken for those hours either way.
+class SweepStats:
+    """Process-wide counters of sweeper runs."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "skipped": 0, "seconds": 0.0, "completed": 0, "overdue": 0,
+                       "last_run_at": None, "last_completed": 0, "last_overdue": 0}
+
+    def record(self, counts, seconds):
+        with self._lock:
+            if counts is None:
+                self._stats["skipped"] += 1
+                return
+            self._stats["runs"] += 1
+            self._stats["seconds"] += seconds
+            self._stats["last_run_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for status, n in counts.items():
+                self._stats[status] += n
+                self._stats[f"last_{status}"] = n
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+@st.cache_resource
+def _sweep_stats():
+    return SweepStats()
+
+@instrumented("db")
+def sweep_reservations(batch_size=None, grace_minutes=None):
+    """Move past-exit reservations to completed / overdue, batch_size rows per UPDATE.
+
+    Every batch commits on its own, so row locks are short and an interrupted sweep simply
+    continues on the next run. A MySQL named lock keeps several processes from sweeping at
+    once; if another one holds it this returns None. Otherwise returns
+    {"completed": n, "overdue": n}.
+    """
+    batch_size = batch_size or SWEEP_CONFIG["batch_size"]
+    grace_minutes = SWEEP_CONFIG["overdue_grace_minutes"] if grace_minutes is None else grace_minutes
+    now = datetime.now()
+    # new status -> (current status, exit time cutoff)
+    transitions = {
+        "completed": ("paid", now),
+        "overdue": ("reserved", now - timedelta(minutes=grace_minutes))
+    }
+    started = time.perf_counter()
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT GET_LOCK('vpark_sweeper', 0)")
+    if cur.fetchone()[0] != 1:
+        cur.close()
+        conn.close()
+        _sweep_stats().record(None, 0.0)
+        return None
+    counts = {}
+    try:
+        for new_status, (old_status, cutoff) in transitions.items():
+            counts[new_status] = 0
+            while True:
+                conn.start_transaction()
+                # (status, exit_datetime) index: each batch reads and locks only the rows it updates
+                cur.execute("""
+                    SELECT reservation_id FROM reservations
+                    WHERE status=%s AND exit_datetime < %s
+                    ORDER BY exit_datetime, reservation_id LIMIT %s FOR UPDATE
+                """, (old_status, cutoff, batch_size))
+                ids = [row[0] for row in cur.fetchall()]
+                if not ids:
+                    conn.rollback()
+                    break
+                marks = ",".join(["%s"] * len(ids))
+                cur.execute(f"UPDATE reservations SET status=%s WHERE reservation_id IN ({marks})", [new_status] + ids)
+                conn.commit()
+                counts[new_status] += len(ids)
+                # like cancel and settle: this process's index now, other workers via the change log
+                index = _availability()
+                for rid in ids:
+                    index.set_status(rid, new_status)
+                publish_change("status", reservation_ids=ids, status=new_status)
+                if len(ids) < batch_size:
+                    break
+    finally:
+        cur.execute("SELECT RELEASE_LOCK('vpark_sweeper')")
+        cur.fetchall()
+        cur.close()
+        conn.close()
+    _sweep_stats().record(counts, time.perf_counter() - started)
+    return counts
+
+def _sweeper_loop():
+    while True:
+        try:
+            sweep_reservations()
+        except Exception as e:
+            print(f"[vpark sweeper] {e}", file=sys.stderr)
+        time.sleep(SWEEP_CONFIG["interval_seconds"])
+
+@st.cache_resource
+def _start_sweeper():
+    # one background thread per process; the named lock keeps processes from overlapping
+    if not SWEEP_CONFIG["enabled"]:
+        return None
+    thread = threading.Thread(target=_sweeper_loop, name="vpark-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+# ===================== GATE SERVICE =====================
+# Headless HTTP/JSON service for barrier gates and kiosks, outside the Streamlit rerun loop:
+#   POST /gates/<gate>/check-in   {"vehicle_no": "KA01AB1234"}
+#   POST /gates/<gate>/check-out  {"vehicle_no": "KA01AB1234"}
+#   GET  /metrics, GET /health
+PLATE_SEPARATORS = (" ", "-", ".")   # must match the vehicle_plate column (migration 9)
+
+def normalize_plate(vehicle_no):
+    plate = str(vehicle_no)
+    for separator in PLATE_SEPARATORS:
+        plate = plate.replace(separator, "")
+    return plate.upper()
+
+def _plate_known(cur, plate):
+    cur.execute("SELECT 1 FROM user_details WHERE vehicle_plate=%s LIMIT 1", (plate,))
+    return cur.fetchone() is not None
+
+@instrumented("db")
+def gate_check_in(vehicle_no, now=None):
+    """Check in the plate's booking that covers now. Returns (ok, info_or_error).
+
+    A plate can be registered on several accounts; a booking on any of them is found.
+    """
+    now = now or datetime.now()
+    plate = normalize_plate(vehicle_no)
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        # vehicle_plate index to the owners, then (user_id, entry_datetime) to their bookings around now
+        cur.execute("""
+            SELECT r.reservation_id, r.level_no, r.slot_no, r.entry_datetime, r.exit_datetime, r.paid
+            FROM user_details u JOIN reservations r ON r.user_id = u.user_id
+            WHERE u.vehicle_plate=%s AND r.entry_datetime <= %s AND r.exit_datetime > %s
+            AND r.status IN ('reserved','paid') AND r.checked_in_at IS NULL
+            ORDER BY r.entry_datetime LIMIT 1
+        """, (plate, now + timedelta(minutes=GATE_CONFIG["early_checkin_minutes"]),
+              now - timedelta(minutes=GATE_CONFIG["late_checkin_minutes"])))
+        row = cur.fetchone()
+        if not row:
+            return False, "No reservation to check in right now." if _plate_known(cur, plate) else "Unknown vehicle."
+        # guarded update: of two gates racing for the same booking only one wins
+        cur.execute("UPDATE reservations SET checked_in_at=%s WHERE reservation_id=%s AND checked_in_at IS NULL", (now, row[0]))
+        conn.commit()
+        if cur.rowcount != 1:
+            return False, "Already checked in."
+    finally:
+        cur.close()
+        conn.close()
+    return True, {"reservation_id": row[0], "level_no": row[1], "slot_no": row[2],
+                  "entry_datetime": row[3].isoformat(), "exit_datetime": row[4].isoformat(), "paid": bool(row[5])}
+
+@instrumented("db")
+def gate_check_out(vehicle_no, now=None):
+    """Check out the plate's checked-in booking. Returns (ok, info_or_error); info says what is still due."""
+    now = now or datetime.now()
+    plate = normalize_plate(vehicle_no)
+    conn = get_db_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT r.reservation_id, r.level_no, r.slot_no, r.entry_datetime, r.exit_datetime, r.vehicle_type, r.paid
+            FROM user_details u JOIN reservations r ON r.user_id = u.user_id
+            WHERE u.vehicle_plate=%s AND r.entry_datetime <= %s AND r.checked_in_at IS NOT NULL AND r.checked_out_at IS NULL
+            ORDER BY r.entry_datetime DESC LIMIT 1
+        """, (plate, now + timedelta(minutes=GATE_CONFIG["early_checkin_minutes"])))
+        row = cur.fetchone()
+        if not row:
+            return False, "No checked-in reservation for this vehicle." if _plate_known(cur, plate) else "Unknown vehicle."
+        cur.execute("UPDATE reservations SET checked_out_at=%s WHERE reservation_id=%s AND checked_out_at IS NULL", (now, row[0]))
+        conn.commit()
+        if cur.rowcount != 1:
+            return False, "Already checked out."
+    finally:
+        cur.close()
+        conn.close()
+    # priced for the time actually used when the car stayed past its booking
+    amount, hours = compute_cost(row[5], row[3], max(row[4], now))
+    return True, {"reservation_id": row[0], "level_no": row[1], "slot_no": row[2],
+                  "paid": bool(row[6]), "amount_due": 0.0 if row[6] else amount, "hours": hours}
+
+class GateStats:
+    """Request counters and latency totals per gate and endpoint."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}   # (gate, endpoint, outcome) -> [requests, seconds]
+
+    def record(self, gate, endpoint, outcome, seconds):
+        with self._lock:
+            entry = self._by_key.setdefault((gate, endpoint, outcome), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def metrics(self):
+        with self._lock:
+            items = sorted(self._by_key.items())
+        lines = ["# HELP vpark_gate_requests_total Gate requests by gate, endpoint and outcome.",
+                 "# TYPE vpark_gate_requests_total counter"]
+        lines += [f'vpark_gate_requests_total{{gate="{g}",endpoint="{e}",outcome="{o}"}} {v[0]}' for (g, e, o), v in items]
+        lines += ["# HELP vpark_gate_request_seconds_total Time spent answering gate requests.",
+                  "# TYPE vpark_gate_request_seconds_total counter"]
+        lines += [f'vpark_gate_request_seconds_total{{gate="{g}",endpoint="{e}",outcome="{o}"}} {v[1]}' for (g, e, o), v in items]
+        return "\n".join(lines) + "\n"
+
+@st.cache_resource
+def _gate_stats():
+    return GateStats()
+
+GATE_ACTIONS = {"check-in": gate_check_in, "check-out": gate_check_out}
+
+def gate_authorized(gate, token):
+    """True if `token` is this gate's token or the shared secret (gate=None: any configured token)."""
+    if not token:
+        return False
+    if gate is None:
+        candidates = list(GATE_CONFIG["tokens"].values())
+    else:
+        candidates = [GATE_CONFIG["tokens"].get(gate, "")]
+    candidates.append(GATE_CONFIG["secret"])
+    return any(c and hmac.compare_digest(c.encode("utf-8"), token.encode("utf-8")) for c in candidates)
+
+class GateRequestError(Exception):
+    """Malformed gate request; answered with HTTP 400."""
+
+def make_gate_handler(clock=None):
+    """Request handler class; clock() gives the gate's "now" (datetime.now by default)."""
+    from http.server import BaseHTTPRequestHandler
+    clock = clock or datetime.now
+
+    class GateHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, so a gate reuses its connection
+
+        def _send(self, status, body, content_type="application/json"):
+            data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, default=str).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _token(self):
+            auth = self.headers.get("Authorization", "")
+            return auth[len("Bearer "):].strip() if auth.startswith("Bearer ") else ""
+
+        def _read_body(self):
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                raise GateRequestError("Invalid Content-Length.")
+            if length < 0 or length > 4096:
+                raise GateRequestError("Invalid Content-Length.")
+            return self.rfile.read(length) if length else b""
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"ok": True})
+            elif self.path == "/metrics":
+                if not gate_authorized(None, self._token()):
+                    self._send(401, {"ok": False, "error": "Unauthorized."})
+                    return
+                self._send(200, prometheus_metrics() + _gate_stats().metrics(), "text/plain; version=0.0.4")
+            else:
+                self._send(404, {"ok": False, "error": "Not found."})
+
+        def do_POST(self):
+            started = time.perf_counter()
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 3 or parts[0] != "gates" or parts[2] not in GATE_ACTIONS:
+                self.close_connection = True   # the body was not read
+                self._send(404, {"ok": False, "error": "Not found."})
+                return
+            gate, endpoint = parts[1], parts[2]
+            try:
+                if not gate_authorized(gate, self._token()):
+                    self.close_connection = True
+                    gate = "-"   # not a gate we know: keep made-up names out of the metrics
+                    status, body, outcome = 401, {"ok": False, "error": "Unauthorized."}, "unauthorized"
+                else:
+                    try:
+                        payload = json.loads(self._read_body() or b"{}")
+                    except ValueError:
+                        raise GateRequestError("Body must be a JSON object.")
+                    vehicle_no = payload.get("vehicle_no") if isinstance(payload, dict) else None
+                    if not isinstance(vehicle_no, str) or not vehicle_no.strip():
+                        raise GateRequestError("vehicle_no is required.")
+                    ok, info = GATE_ACTIONS[endpoint](vehicle_no, now=clock())
+                    status, outcome = (200, "ok") if ok else (404, "rejected")
+                    body = {"ok": True, **info} if ok else {"ok": False, "error": info}
+            except GateRequestError as e:
+                self.close_connection = True
+                status, body, outcome = 400, {"ok": False, "error": str(e)}, "bad_request"
+            except mysql.Error as e:
+                print(f"[vpark gate] {e}", file=sys.stderr)
+                status, body, outcome = 503, {"ok": False, "error": "Database unavailable."}, "error"
+            except Exception as e:
+                print(f"[vpark gate] {e!r}", file=sys.stderr)
+                status, body, outcome = 500, {"ok": False, "error": "Internal error."}, "error"
+            try:
+                self._send(status, body)
+            finally:
+                _gate_stats().record(gate, endpoint, outcome, time.perf_counter() - started)
+
+        def log_message(self, format, *args):
+            pass   # one line per request is too much at gate rates; see /metrics
+
+    return GateHandler
+
+def make_gate_server(host=None, port=None, clock=None):
+    """ThreadingHTTPServer for the gate API."""
+    from http.server import ThreadingHTTPServer
+    if not GATE_CONFIG["secret"] and not GATE_CONFIG["tokens"]:
+        raise RuntimeError("Set VPARK_GATE_TOKENS or VPARK_GATE_SECRET before starting the gate API.")
+    init_db()
+    server = ThreadingHTTPServer((host or GATE_CONFIG["host"], GATE_CONFIG["port"] if port is None else port), make_gate_handler(clock))
+    server.daemon_threads = True
+    return server
+
+# ===================== BULK IMPORT / EXPORT =====================
+USER_COLUMNS = ["user_id", "user_name", "user_password", "user_addr", "vehicle_no", "user_mobile_no", "vehicle_type"]
+RESERVATION_COLUMNS = ["user_id", "level_no", "slot_no", "entry_datetime", "exit_datetime", "vehicle_type",
+                       "status", "bill_amount", "paid", "paid_at"]
+
+def _bcrypt_hash(job):
+    # top-level so it can run in a process pool
+    password, rounds = job
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds))
+
+def iter_file_chunks(path, batch_size):
+    """Yield DataFrames of up to batch_size rows from a .csv or .parquet file."""
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq   # optional dependency, only needed for Parquet
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=batch_size, dtype=str, keep_default_na=False, na_values=[""])
+
+def _none_for_nan(df):
+    return df.astype(object).where(df.notna(), None)
+
+def import_users(path, batch_size=None, workers=None, rounds=None, skip_existing=False, progress=print):
+    """Load users from CSV/Parquet in batches. Returns the number of rows written.
+
+    The file needs the USER_COLUMNS, except that a plain-text `password` column may be
+    given instead of `user_password`; those passwords are bcrypt-hashed in parallel.
+    Rows without a password are skipped and reported, never imported with a made-up one.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    batch_size = batch_size or BULK_CONFIG["batch_size"]
+    workers = workers or BULK_CONFIG["hash_workers"]
+    rounds = rounds or AUTH_CONFIG["bcrypt_rounds"]
+    verb = "INSERT IGNORE" if skip_existing else "INSERT"
+    sql = f"{verb} INTO user_details ({','.join(USER_COLUMNS)}) VALUES ({','.join(['%s'] * len(USER_COLUMNS))})"
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in iter_file_chunks(path, batch_size):
+            password_col = "user_password" if "user_password" in chunk.columns else "password"
+            if password_col not in chunk.columns:
+                raise ValueError("Users file needs a 'password' or 'user_password' column.")
+            # blank CSV cells and Parquet nulls: str() would turn them into "nan" / "None"
+            missing = chunk[password_col].map(lambda v: pd.isna(v) or (isinstance(v, str) and not v.strip())).astype(bool)
+            if missing.any():
+                ids = ", ".join(str(u) for u in chunk.loc[missing, "user_id"].head(10))
+                progress(f"users: skipped {int(missing.sum())} rows without a password ({ids}{', ...' if missing.sum() > 10 else ''})")
+                chunk = chunk[~missing].copy()
+                if chunk.empty:
+                    continue
+            if password_col == "password":
+                chunk["user_password"] = list(pool.map(_bcrypt_hash, [(p if isinstance(p, str) else str(p), rounds) for p in chunk["password"]],
+                                                       chunksize=32))
+            else:
+                chunk["user_password"] = [h.encode("utf-8") if isinstance(h, str) else h for h in chunk["user_password"]]
+            for col in USER_COLUMNS:
+                if col not in chunk.columns:
+                    chunk[col] = None
+            rows = [tuple(r) for r in _none_for_nan(chunk[USER_COLUMNS]).itertuples(index=False)]
+            conn = get_db_conn()
+            cur = conn.cursor()
+            try:
+                conn.start_transaction()
+                cur.executemany(sql, rows)
+                conn.commit()
+                written += cur.rowcount
+            finally:
+                cur.close()
+                conn.close()
+            for user_id in chunk["user_id"]:
+                invalidate_user(user_id, publish=False)
+            progress(f"users: {written} rows written")
+    # one notice for the whole import instead of one per user
+    publish_change("users")
+    return written
+
+def import_reservations(path, batch_size=None, progress=print):
+    """Load reservations from CSV/Parquet in batches, keeping occupancy_hourly in step.
+
+    Required columns: user_id, level_no, slot_no, entry_datetime, exit_datetime,
+    vehicle_type. status defaults to 'reserved', paid to 0, and bill_amount is priced
+    with compute_costs_bulk when missing. Rows are inserted as given, without the
+    overlap check claim_slot does.
+    """
+    batch_size = batch_size or BULK_CONFIG["batch_size"]
+    sql = f"INSERT INTO reservations ({','.join(RESERVATION_COLUMNS)}) VALUES ({','.join(['%s'] * len(RESERVATION_COLUMNS))})"
+    written = 0
+    for chunk in iter_file_chunks(path, batch_size):
+        chunk["entry_datetime"] = pd.to_datetime(chunk["entry_datetime"])
+        chunk["exit_datetime"] = pd.to_datetime(chunk["exit_datetime"])
+        chunk["level_no"] = chunk["level_no"].astype(int)
+        chunk["slot_no"] = chunk["slot_no"].astype(int)
+        if "status" not in chunk.columns:
+            chunk["status"] = "reserved"
+        chunk["status"] = chunk["status"].fillna("reserved")
+        chunk["paid"] = pd.to_numeric(chunk["paid"]).fillna(0).astype(int) if "paid" in chunk.columns else 0
+        amounts, hours = compute_costs_bulk(chunk["vehicle_type"], chunk["entry_datetime"], chunk["exit_datetime"])
+        if "bill_amount" in chunk.columns:
+            chunk["bill_amount"] = pd.to_numeric(chunk["bill_amount"]).fillna(pd.Series(amounts, index=chunk.index))
+        else:
+            chunk["bill_amount"] = amounts
+        chunk["paid_at"] = pd.to_datetime(chunk["paid_at"]) if "paid_at" in chunk.columns else pd.NaT
+        # pandas Timestamps are datetime subclasses, so the connector converts them as-is
+        out = _none_for_nan(chunk[RESERVATION_COLUMNS])
+        rows = [tuple(r) for r in out.itertuples(index=False)]
+        booked = chunk[chunk["status"] != "cancelled"]
+        conn = get_db_conn()
+        cur = conn.cursor()
+        try:
+            conn.start_transaction()
+            cur.executemany(sql, rows)
+            apply_occupancy(cur, zip(booked["level_no"], out.loc[booked.index, "entry_datetime"], out.loc[booked.index, "exit_datetime"]), reserved=1)
+            paid = booked[booked["paid"] == 1]
+            apply_occupancy(cur, zip(paid["level_no"], out.loc[paid.index, "entry_datetime"], out.loc[paid.index, "exit_datetime"]), paid=1)
+            conn.commit()
+            written += len(rows)
+        finally:
+            cur.close()
+            conn.close()
+        progress(f"reservations: {written} rows written")
+    # imported rows skip the incremental index updates: rebuild it here and in the other workers
+    _availability.clear()
+    publish_change("reservations")
+    return written
+
+EXPORT_QUERIES = {
+    "users": "SELECT user_id, user_name, user_password, user_addr, vehicle_no, user_mobile_no, vehicle_type, created_at FROM user_details",
+    "reservations": ("SELECT reservation_id, user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, "
+                     "status, bill_amount, paid, paid_at, created_at FROM reservations "
+                     "UNION ALL "
+                     "SELECT reservation_id, user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, "
+                     "status, bill_amount, paid, paid_at, created_at FROM reservations_archive")
+}
+
+def export_table(kind, path, batch_size=None, progress=print):
+    """Stream `users` or `reservations` to a .csv or .parquet file chunk by chunk."""
+    batch_size = batch_size or BULK_CONFIG["batch_size"]
+    parquet = path.lower().endswith(".parquet")
+    writer = None
+    written = 0
+    conn = get_db_conn(read="export_table")
+    cur = conn.cursor()   # unbuffered: rows stream from the server
+    try:
+        cur.execute(EXPORT_QUERIES[kind])
+        columns = [d[0] for d in cur.description]
+        with (open(path, "wb") if parquet else open(path, "w", newline="")) as f:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=columns)
+                if "user_password" in df.columns:
+                    df["user_password"] = [h.decode("utf-8") if isinstance(h, (bytes, bytearray)) else h for h in df["user_password"]]
+                if parquet:
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(f, _export_schema(kind))
+                    writer.write_table(table.cast(_export_schema(kind)))
+                else:
+                    df.to_csv(f, header=written == 0, index=False)
+                written += len(df)
+                progress(f"{kind}: {written} rows exported")
+            if writer is not None:
+                writer.close()
+    finally:
+        cur.close()
+        conn.close()
+    return written
+
+def _export_schema(kind):
+    import pyarrow as pa
+    if kind == "users":
+        return pa.schema([("user_id", pa.string()), ("user_name", pa.string()), ("user_password", pa.string()),
+                          ("user_addr", pa.string()), ("vehicle_no", pa.string()), ("user_mobile_no", pa.string()),
+                          ("vehicle_type", pa.string()), ("created_at", pa.timestamp("us"))])
+    return pa.schema([("reservation_id", pa.int64()), ("user_id", pa.string()), ("level_no", pa.int64()),
+                      ("slot_no", pa.int64()), ("entry_datetime", pa.timestamp("us")), ("exit_datetime", pa.timestamp("us")),
+                      ("vehicle_type", pa.string()), ("status", pa.string()), ("bill_amount", pa.float64()),
+                      ("paid", pa.int64()), ("paid_at", pa.timestamp("us")), ("created_at", pa.timestamp("us"))])
+
+# ===================== STATIC ASSETS =====================
+class AssetCache:
+    """Encoded images and CSS fragments, rebuilt only when the source file's mtime/size changes."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = {}   # key -> (file stamp, value)
+
+    def get(self, key, stamp, build):
+        with self._lock:
+            hit = self._items.get(key)
+        if hit and hit[0] == stamp:
+            return hit[1]
+        value = build()
+        with self._lock:
+            self._items[key] = (stamp, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+@st.cache_resource
+def _asset_cache():
+    return AssetCache()
+
+def _file_stamp(path):
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
 
-def get_user(user_id):
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT user_id,user_name,user_password,user_addr,vehicle_no,user_mobile_no,vehicle_type
-        FROM user_details WHERE user_id=%s
-    """, (user_id,))
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
-    if not row:
+def _encode_image(path, width, fmt, quality):
+    with Image.open(path) as img:
+        img.load()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if fmt == "JPEG" and has_alpha:
+            fmt = "PNG"
+        img = img.convert("RGBA" if has_alpha else "RGB")
+        if width and img.width > width:
+            img.thumbnail((width, max(1, img.height * width // img.width)), Image.LANCZOS)
+        buf = io.BytesIO()
+        if fmt == "PNG":
+            img.save(buf, format="PNG", optimize=True)
+        elif fmt == "JPEG":
+            img.save(buf, format="JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue(), "image/" + fmt.lower()
+
+def encode_image(path, width, fmt=None, quality=None):
+    """Return (bytes, mime type) of `path` downscaled to at most `width` px, or None if missing."""
+    fmt = (fmt or ASSET_CONFIG["format"]).upper()
+    quality = quality or ASSET_CONFIG["quality"]
+    stamp = _file_stamp(path)
+    if stamp is None:
         return None
-    # Ensure password is bytes
-    password_hash = row[2]
-    if isinstance(password_hash, str):
-        password_hash = password_hash.encode("utf-8")  # convert to bytes
-    return {
-        "user_id": row[0],
-        "name": row[1],
-        "password_hash": password_hash,  # now definitely bytes
-        "address": row[3],
-        "vehicle_no": row[4],
-        "mobile_no": row[5],
-        "vehicle_type": row[6]
-    }
-                    
-def user_exists(user_id):
-    return get_user(user_id) is not None
+    return _asset_cache().get(("image", path, width, fmt, quality), stamp,
+                              lambda: _encode_image(path, width, fmt, quality))
 
-def authenticate_user(user_id, password):
-    user = get_user(user_id)
-    if not user:
+def pick_width(widths, display_width, density=2):
+    """Smallest configured variant that is sharp at display_width on a `density`x screen."""
+    wanted = display_width * density
+    fitting = [w for w in sorted(widths) if w >= wanted]
+    return fitting[0] if fitting else max(widths)
+
+def _static_serving_enabled():
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
         return False
-    return check_password(password, user["password_hash"])
 
-def create_reservation_db(user_id, level_no, slot_no, entry_dt, exit_dt, vehicle_type, bill_amount=0.0):
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO reservations (user_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, bill_amount, status, paid)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,'reserved',0)
-    """, (user_id, level_no, slot_no, entry_dt, exit_dt, vehicle_type, bill_amount))
-    conn.commit()
-    cur.close()
-    conn.close()
+def _build_background_css(path, stamp):
+    if not _static_serving_enabled():
+        encoded = encode_image(path, ASSET_CONFIG["inline_background_width"])
+        if encoded is None:
+            # removed since background_css looked: no background this time
+            return None
+        data, mime = encoded
+        b64 = base64.b64encode(data).decode()
+        return f'.stApp {{ background-image: url("data:{mime};base64,{b64}"); }}'
+    # with static serving the browser downloads (and caches) only the variant it needs
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    os.makedirs(static_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    rules = []
+    widths = sorted(ASSET_CONFIG["background_widths"])
+    for i, width in enumerate(widths):
+        encoded = encode_image(path, width)
+        if encoded is None:
+            return None
+        data, mime = encoded
+        name = f"vpark_{stem}_{width}.{mime.split('/')[1]}"
+        with open(os.path.join(static_dir, name), "wb") as f:
+            f.write(data)
+        rule = f'.stApp {{ background-image: url("app/static/{name}?v={stamp[0]}"); }}'
+        if i > 0:
+            rule = f"@media (min-width: {widths[i - 1] + 1}px) {{ {rule} }}"
+        rules.append(rule)
+    return "\n".join(rules)
 
-def reservations_for_user(user_id):
-    conn = get_db_conn()
-    df = pd.read_sql("SELECT reservation_id, level_no, slot_no, entry_datetime, exit_datetime, vehicle_type, status, bill_amount, paid FROM reservations WHERE user_id=%s ORDER BY created_at DESC", 
-                     conn, params=(user_id,))
-    conn.close()
-    return df
+def background_css(path):
+    """CSS rules that set `path` as the page background, or None if the file is missing."""
+    stamp = _file_stamp(path)
+    if stamp is None:
+        return None
+    key = ("background_css", path, ASSET_CONFIG["format"], ASSET_CONFIG["quality"],
+           tuple(ASSET_CONFIG["background_widths"]), ASSET_CONFIG["inline_background_width"], _static_serving_enabled())
+    return _asset_cache().get(key, stamp, lambda: _build_background_css(path, stamp))
 
-def get_overlapping_reserved_slots(level_no, entry_dt, exit_dt):
-    """Return set of slot numbers in `level_no` that overlap with given period and not cancelled."""
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT slot_no FROM reservations
-        WHERE level_no=%s AND status IN ('reserved','paid') AND NOT (exit_datetime <= %s OR entry_datetime >= %s)
-    """, (level_no, entry_dt, exit_dt))
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    return set(r[0] for r in rows)
+# ===================== RECEIPTS =====================
+@st.cache_resource
+def _receipt_font():
+    # probed once per process instead of on every receipt
+    try:
+        return ImageFont.truetype(RECEIPT_CONFIG["font_path"], RECEIPT_CONFIG["font_size"])
+    except Exception:
+        return ImageFont.load_default()
 
-def compute_cost(vehicle_type, entry_dt, exit_dt):
-    seconds = (exit_dt - entry_dt).total_seconds()
-    hours = math.ceil(seconds / 3600)
-    key = str(vehicle_type).lower()
-    if "2" in key:
-        rate = RATES["2 wheeler"]
-    elif "3" in key:
-        rate = RATES["3 wheeler"]
-    else:
-        rate = RATES["4 wheeler"]
-    return rate * max(1, hours), hours
+@st.cache_resource
+def _receipt_template():
+    # blank receipt with the title already drawn; every receipt starts from a copy
+    img = Image.new("RGB", (800, 500), color="white")
+    ImageDraw.Draw(img).text((40, 30), "VPark Receipt", font=_receipt_font())
+    return img
 
-def mark_reservation_paid(reservation_id, amount):
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE reservations SET paid=1, bill_amount=%s, status='paid' WHERE reservation_id=%s", (amount, reservation_id))
-    conn.commit()
-    cur.close()
-    conn.close()
+def render_receipt_image(receipt_info):
+    img = _receipt_template().copy()
+    height = 70 + 30 * len(receipt_info) + 60
+    if height > img.height:
+        # long receipts (batch settlements) get a taller canvas
+        img = Image.new("RGB", (img.width, height), color="white")
+        img.paste(_receipt_template(), (0, 0))
+    draw = ImageDraw.Draw(img)
+    font = _receipt_font()
+    y = 70
+    for k, v in receipt_info.items():
+        draw.text((40, y), f"{k}: {v}", font=font)
+        y += 30
+    # small footer
+    draw.text((40, y+20), "Thank you for using VPark!", font=font)
+    return img
 
-def cancel_reservation_db(reservation_id, user_id):
-    """Cancel only if the reservation belongs to the user and entry_datetime is in future and status reserved."""
-    conn = get_db_conn()
-    cur = conn.cursor()
-    # verify conditions
-    cur.execute("SELECT entry_datetime, status FROM reservations WHERE reservation_id=%s AND user_id=%s", (reservation_id, user_id))
-    row = cur.fetchone()
-    if not row:
-        cur.close()
-        conn.close()
-        return False, "Reservation not found."
-    entry_dt, status = row[0], row[1]
-    if status != "reserved":
-        cur.close()
-        conn.close()
-        return False, "Only reserved reservations can be cancelled."
-    if entry_dt <= datetime.now():
+def render_receipt_png_bytes(receipt_info):
+    """PNG bytes of a receipt, encoded into a per-thread buffer that is reused between calls."""
+    buf = getattr(_thread_state, "receipt_buf", None)
+    if buf is None:
+        buf = _thread_state.receipt_buf = io.BytesIO()
+    buf.seek(0)
+    buf.truncate()
+    render_receipt_image(receipt_info).save(buf, format="PNG")
+    return buf.getvalue()
+
+def receipt_info(reservation_id, user_id, amount, paid_at):
+    return {
+        "Reservation ID": reservation_id,
+        "User": user_id,
+        "Amount Paid": f"{amount:.2f}",
+        "Paid At": paid_at.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+def settlement_receipt_info(user_id, settled, paid_at):
+    """One consolidated receipt for a batch settlement, a line per reservation."""
+    info = {"User": user_id, "Bills Settled": len(settled)}
+    for bill in settled:
+        info[f"Reservation {bill['reservation_id']}"] = f"{bill['amount']:.2f} ({bill['hours']} h)"
+    info["Total Paid"] = f"{sum(b['amount'] for b in settled):.2f}"
+    info["Paid At"] = paid_at.strftime("%Y-%m-%d %H:%M:%S")
+    return info
+
+def iter_paid_receipts(start_dt, end_dt, chunk_size=None):
+    """Yield lists of receipt_info dicts for reservations paid in [start_dt, end_dt), oldest first."""
+    chunk_size = chunk_size or RECEIPT_CONFIG["chunk_size"]
+    conn = get_db_conn(read="iter_paid_receipts")
+    cur = conn.cursor()   # unbuffered: rows stream from the server chunk by chunk
+    try:
+        cur.execute("""
+            SELECT reservation_id, user_id, bill_amount, paid_at FROM reservations
+            WHERE paid=1 AND paid_at >= %s AND paid_at < %s
+            UNION ALL
+            SELECT reservation_id, user_id, bill_amount, paid_at FROM reservations_archive
+            WHERE paid=1 AND paid_at >= %s AND paid_at < %s
+            ORDER BY paid_at, reservation_id
+        """, (start_dt, end_dt, start_dt, end_dt))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [receipt_info(*row) for row in rows]
+    finally:
         cur.close()
         conn.close()
-        return False, "Cannot cancel a reservation whose entry time has passed or is ongoing."
-    cur.execute("UPDATE reservations SET status='cancelled' WHERE reservation_id=%s", (reservation_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-    return True, None
+
+def export_receipts(start_dt, end_dt, out, fmt="zip", workers=None, chunk_size=None):
+    """Render receipts for a paid-at date range into a ZIP of PNGs or a multi-page PDF.
+
+    Receipts are fetched and rendered chunk by chunk in a process pool and written out as
+    they arrive, so memory stays bounded by one chunk. Returns the number of receipts.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import zipfile
+    workers = workers or RECEIPT_CONFIG["workers"]
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        if fmt == "zip":
+            with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:   # PNG is already compressed
+                for chunk in iter_paid_receipts(start_dt, end_dt, chunk_size):
+                    for info, png in zip(chunk, pool.map(render_receipt_png_bytes, chunk, chunksize=16)):
+                        zf.writestr(f"receipt_{info['Reservation ID']}.png", png)
+                        count += 1
+        elif fmt == "pdf":
+            for chunk in iter_paid_receipts(start_dt, end_dt, chunk_size):
+                pages = [Image.open(io.BytesIO(png)) for png in pool.map(render_receipt_png_bytes, chunk, chunksize=16)]
+                # append each chunk to the file so only one chunk of pages is held in memory
+                pages[0].save(out, format="PDF", save_all=True, append_images=pages[1:], append=count > 0)
+                count += len(pages)
+        else:
+            raise ValueError(f"Unknown receipt export format: {fmt}")
+    return count
 
 # ===================== UI - Helpers =====================
+ENTRY_GRACE_MINUTES = 5   # forms prefill "now", so allow for the time spent filling them in
+
+def entry_in_past(entry_dt):
+    return entry_dt < datetime.now() - timedelta(minutes=ENTRY_GRACE_MINUTES)
+
+@instrumented("page")
 def set_background_image():
-    b64 = image_to_base64(BACKGROUND_IMAGE_PATH)
-    if not b64:
+    css = background_css(BACKGROUND_IMAGE_PATH)
+    if not css:
         return
     page_bg_img = f"""
     <style>
+    {css}
     .stApp {{
-      background-image: url("data:image/jpg;base64,{b64}");
       background-size: cover;
       background-position: center;
     }}
@@ -254,29 +3212,13 @@ def set_background_image():
 
 def make_receipt_png(receipt_info: dict) -> io.BytesIO:
     """Create a PNG receipt (PIL) and return BytesIO."""
-    width, height = 800, 500
-    img = Image.new("RGB", (width, height), color="white")
-    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.truetype("arial.ttf", 20)
-    except Exception:
-        font = ImageFont.load_default()
-
-    y = 30
-    draw.text((40, y), "VPark Receipt", font=font)
-    y += 40
-    for k, v in receipt_info.items():
-        draw.text((40, y), f"{k}: {v}", font=font)
-        y += 30
-
-    # small footer
-    draw.text((40, y+20), "Thank you for using VPark!", font=font)
     buf = io.BytesIO()
-    img.save(buf, format="PNG")
+    render_receipt_image(receipt_info).save(buf, format="PNG")
     buf.seek(0)
     return buf
 
 # ===================== PAGES =====================
+@instrumented("page")
 def home_page():
     st.set_page_config(page_title="VPark", layout="wide", initial_sidebar_state="collapsed")
     set_background_image()
@@ -299,6 +3241,7 @@ def home_page():
             st.session_state.page = "signup"
     st.markdown("</div>", unsafe_allow_html=True)
 
+@instrumented("page")
 def about_page():
     st.header("About VPark")
     st.write("Smart Parking system built with Streamlit and MySQL.")
@@ -311,6 +3254,7 @@ def about_page():
         st.session_state.page = "home"
 
 # ---------- Signup ----------
+@instrumented("page")
 def signup_page():
     st.header("Sign Up")
     with st.form("signup_form"):
@@ -330,11 +3274,14 @@ def signup_page():
                 if ok:
                     st.success("Account created! Please login.")
                     st.session_state.page = "login"
+                elif err == "User ID already exists":
+                    st.error(err)
                 else:
                     st.error(f"Error: {err}")
     if st.button("Back to Home"):
         st.session_state.page = "home"
 # ---------- Login ----------
+@instrumented("page")
 def login_page():
     st.header("Login")
     with st.form("login_form"):
@@ -342,16 +3289,18 @@ def login_page():
         pw = st.text_input("Password", type="password")
         submitted = st.form_submit_button("Login")
         if submitted:
-            if authenticate_user(uid, pw):
+            ok, err = login(uid, pw)
+            if ok:
                 st.success("Logged in!")
                 st.session_state.user_id = uid
                 st.session_state.page = "welcome"
             else:
-                st.error("Invalid credentials")
+                st.error(err)
     if st.button("Back to Home"):
         st.session_state.page = "home"
 
 # ---------- Sidebar user info (used on many pages) ----------
+@instrumented("page")
 def show_sidebar_user_info():
     if "user_id" not in st.session_state:
         return
@@ -366,26 +3315,29 @@ def show_sidebar_user_info():
     st.sidebar.markdown("---")
 
     # Pending bills
-    df = reservations_for_user(user["user_id"])
-    pending = df[(df["paid"] == 0) & (df["status"] == "reserved")]
-    if not pending.empty:
+    pending = pending_bills_for_user(user["user_id"])
+    if pending:
         st.sidebar.markdown("### Pending Bills")
-        for _, row in pending.iterrows():
+        for row in pending:
             rid = int(row["reservation_id"])
-            entry = pd.to_datetime(row["entry_datetime"])
-            exit_ = pd.to_datetime(row["exit_datetime"])
-            amt, hours = compute_cost(row["vehicle_type"], entry, exit_)
-            st.sidebar.markdown(f"- Res {rid}: {entry.strftime('%Y-%m-%d %H:%M')} → {exit_.strftime('%Y-%m-%d %H:%M')} → {amt:.2f}")
+            entry, exit_ = row["entry_datetime"], row["exit_datetime"]
+            overdue = " (overdue)" if row["status"] == "overdue" else ""
+            st.sidebar.markdown(f"- Res {rid}: {entry.strftime('%Y-%m-%d %H:%M')} → {exit_.strftime('%Y-%m-%d %H:%M')} → {row['amount']:.2f}{overdue}")
             if st.sidebar.button(f"Pay {rid}", key=f"pay_sidebar_{rid}"):
                 st.session_state.selected_reservation = rid
                 st.session_state.page = "bill"
     st.sidebar.markdown("---")
+    if is_operator(user["user_id"]) and st.sidebar.button("Occupancy Dashboard"):
+        st.session_state.page = "operator"
+    if user["user_id"] in ADMIN_USERS and st.sidebar.button("Diagnostics"):
+        st.session_state.page = "diagnostics"
     if st.sidebar.button("Logout"):
         st.session_state.clear()
         st.session_state.page = "home"
         st.experimental_rerun()
 
 # ---------- Welcome ----------
+@instrumented("page")
 def welcome_page():
     set_background_image()
 
@@ -396,9 +3348,10 @@ def welcome_page():
     show_sidebar_user_info()
     user = get_user(st.session_state.user_id)
     st.markdown(f"<h2 style='text-align:center;'>Welcome {user['name']}!</h2>", unsafe_allow_html=True)
-    c1, c2, c3 = st.columns(3)
+    c1, c2, c3, c4 = st.columns(4)
     with c1:
         if st.button("Account History"):
+            st.session_state.pop("history_cursors", None)
             st.session_state.page = "history"
     with c2:
         if st.button("Reservation"):
@@ -406,10 +3359,15 @@ def welcome_page():
             st.session_state.pop("reservation", None)
             st.session_state.page = "reserve_time"
     with c3:
+        if st.button("Recurring Booking"):
+            st.session_state.pop("series", None)
+            st.session_state.page = "recurring"
+    with c4:
         if st.button("Current Bills / Checkout"):
             st.session_state.page = "bill"
 
 # ---------- Reservation - select time ----------
+@instrumented("page")
 def reserve_time_page():
     if "user_id" not in st.session_state:
         st.session_state.page = "login"
@@ -424,37 +3382,146 @@ def reserve_time_page():
         exit_date = st.date_input("Exit Date", value=(now + timedelta(hours=1)).date(), min_value=entry_date)
         exit_time = st.time_input("Exit Time", value=(now + timedelta(hours=1)).time().replace(second=0, microsecond=0))
         submitted = st.form_submit_button("Next: Choose Level")
-        if submitted:
+        any_slot = st.form_submit_button("Reserve any suitable slot")
+        if submitted or any_slot:
             entry_dt = datetime.combine(entry_date, entry_time)
             exit_dt = datetime.combine(exit_date, exit_time)
             if exit_dt <= entry_dt:
                 st.error("Exit must be after entry time.")
+            elif entry_in_past(entry_dt):
+                st.error("Entry time is in the past.")
             else:
                 st.session_state.reservation = {
                     "entry_dt": entry_dt,
                     "exit_dt": exit_dt,
                     "vehicle_type": user["vehicle_type"]
                 }
-                st.session_state.page = "choose_level"
+                if any_slot:
+                    book_any_slot(st.session_state.reservation)
+                else:
+                    st.session_state.page = "choose_level"
+    last = st.session_state.get("reservation")
+    if last and st.session_state.page == "reserve_time":
+        show_availability_timeline(last)
+    if st.button("Back"):
+        st.session_state.page = "welcome"
+
+def show_availability_timeline(r):
+    """Heatmap of free slots per level around the last requested window, with bookable alternatives."""
+    import altair as alt
+    timeline, windows = availability_timeline(r["entry_dt"], r["exit_dt"], r["vehicle_type"])
+    st.subheader(f"Free slots around {r['entry_dt'].strftime('%Y-%m-%d %H:%M')}")
+    if timeline.empty:
+        st.info("No slots fit this vehicle type.")
+        return
+    chart = alt.Chart(timeline).mark_rect().encode(
+        x=alt.X("bucket_start:T", title=None),
+        y=alt.Y("level_no:O", title="Level"),
+        color=alt.Color("free:Q", title="Free slots", scale=alt.Scale(scheme="greens")),
+        tooltip=["bucket_start:T", "level_no:O", "free:Q", "capacity:Q"]
+    )
+    st.altair_chart(chart)
+    if not windows:
+        st.warning("No free window of this length in the next hours.")
+        return
+    st.write("Nearest windows with a free slot:")
+    for i, w in enumerate(windows):
+        label = (f"{w['entry_dt'].strftime('%Y-%m-%d %H:%M')} → {w['exit_dt'].strftime('%H:%M')} "
+                 f"({w['free']} free, most on Level {w['best_level']})")
+        if st.button(label, key=f"window_{i}"):
+            st.session_state.reservation = {"entry_dt": w["entry_dt"], "exit_dt": w["exit_dt"],
+                                            "vehicle_type": r["vehicle_type"], "level": w["best_level"]}
+            st.session_state.page = "choose_slot"
+
+# ---------- Recurring booking ----------
+@instrumented("page")
+def recurring_page():
+    if "user_id" not in st.session_state:
+        st.session_state.page = "login"
+        return
+    show_sidebar_user_info()
+    st.header("Recurring Booking")
+    user = get_user(st.session_state.user_id)
+    topology = lot_topology()
+    series = st.session_state.get("series", {})
+    with st.form("series_form"):
+        today = datetime.now().date()
+        start_date = st.date_input("From", value=today, min_value=today)
+        end_date = st.date_input("Until", value=today + timedelta(days=27), min_value=start_date)
+        entry_time = st.time_input("Entry Time", value=datetime.min.time().replace(hour=9))
+        exit_time = st.time_input("Exit Time", value=datetime.min.time().replace(hour=18))
+        pattern = st.radio("Repeat", ["Daily", "Weekly"], horizontal=True)
+        days = st.multiselect("On (weekly)", WEEKDAY_NAMES, default=WEEKDAY_NAMES[:5])
+        level = st.selectbox("Level", topology.levels, index=topology.levels.index(series["level"]) if series.get("level") in topology.levels else 0)
+        # the level can change in the same submit, so the slot is checked against it afterwards
+        slot_no = int(st.number_input("Slot", min_value=1, max_value=max([1] + list(topology.slot_count.values())),
+                                      value=series.get("slot_no", 1), step=1))
+        skip = st.checkbox("Book the free dates and skip the ones that clash")
+        book = st.form_submit_button("Book series")
+        suggest = st.form_submit_button("Suggest a slot free on every date")
+    if book or suggest:
+        weekdays = None if pattern == "Daily" else [WEEKDAY_NAMES.index(d) for d in days]
+        entries, exits = recurrence_windows(start_date, end_date, entry_time, exit_time, weekdays)
+        if len(entries) == 0:
+            st.error("No dates match this pattern.")
+        elif entry_in_past(entries[0].tolist()):
+            st.error("The first date's entry time is in the past; start the series tomorrow.")
+        elif len(entries) > RECURRING_CONFIG["max_occurrences"]:
+            st.error(f"At most {RECURRING_CONFIG['max_occurrences']} dates can be booked at once.")
+        elif suggest:
+            free = {lvl: mask for lvl, mask in series_free_masks(entries, exits, user["vehicle_type"]).items() if mask}
+            if not free:
+                st.warning("No single slot is free on every date; try skipping the clashing dates.")
+            else:
+                best = ALLOCATION_POLICIES[ALLOCATION_CONFIG["policy"]](free)
+                st.session_state.series = {"level": best, "slot_no": (free[best] & -free[best]).bit_length()}
+                st.experimental_rerun()
+        elif slot_no > topology.slot_count.get(level, 0):
+            st.error(f"Level {level} has {topology.slot_count.get(level, 0)} slots.")
+        elif not slot_fits(topology.slot_size(level, slot_no), user["vehicle_type"]):
+            st.error("This slot does not fit your vehicle.")
+        else:
+            ok, booked, conflicts = reserve_series(st.session_state.user_id, level, slot_no, entries, exits, user["vehicle_type"], skip)
+            if ok:
+                st.success(f"Booked {len(booked)} dates on Level {level}, Slot {slot_no} (total {sum(b[3] for b in booked):.2f}).")
+            else:
+                st.error(f"{len(conflicts)} of {len(entries)} dates clash with existing bookings; nothing was booked.")
+            if conflicts:
+                st.write(("Skipped: " if ok else "Clashing dates: ")
+                         + ", ".join(c.strftime("%a %Y-%m-%d") for c in conflicts[:20]) + (" …" if len(conflicts) > 20 else ""))
     if st.button("Back"):
         st.session_state.page = "welcome"
 
 # ---------- Reservation - choose level ----------
+@instrumented("page")
 def choose_level_page():
     show_sidebar_user_info()
+    res = st.session_state.get("reservation")
+    if not res:
+        st.session_state.page = "reserve_time"
+        return
     st.header("Choose Parking Level")
-    cols = st.columns(len(LEVELS))
-    if os.path.exists(CAR_IMAGE_PATH):
-        st.image(CAR_IMAGE_PATH, width=200)
-    for i, level in enumerate(LEVELS):
-        with cols[i]:
-            if st.button(f"Level {level}"):
-                st.session_state.reservation["level"] = level
-                st.session_state.page = "choose_slot"
+    topology = lot_topology()
+    free = free_slot_masks(res["entry_dt"], res["exit_dt"], res["vehicle_type"])
+    car = encode_image(CAR_IMAGE_PATH, pick_width(ASSET_CONFIG["car_widths"], 200))
+    if car:
+        st.image(car[0], width=200)
+    levels_per_row = 5
+    for i in range(0, len(topology.levels), levels_per_row):
+        cols = st.columns(levels_per_row)
+        for col, level in zip(cols, topology.levels[i:i + levels_per_row]):
+            with col:
+                if st.button(f"Level {level}"):
+                    st.session_state.reservation["level"] = level
+                    st.session_state.page = "choose_slot"
+                st.caption(f"{free[level].bit_count()} of {topology.capacity(level, res['vehicle_type'])} free")
+    if st.button("Reserve any suitable slot"):
+        book_any_slot(res)
     if st.button("Back"):
         st.session_state.page = "reserve_time"
 
 # ---------- Reservation - choose slot ----------
+@instrumented("page")
 def choose_slot_page():
     show_sidebar_user_info()
     res = st.session_state.get("reservation")
@@ -466,18 +3533,35 @@ def choose_slot_page():
     level = res["level"]
     st.header(f"Choose Slot — Level {level}")
     st.write(f"{entry_dt.strftime('%Y-%m-%d %H:%M')} → {exit_dt.strftime('%Y-%m-%d %H:%M')}")
-    reserved = get_overlapping_reserved_slots(level, entry_dt, exit_dt)
+    topology = lot_topology()
+    free = free_slot_masks(entry_dt, exit_dt, res["vehicle_type"])[level]
+    fits = topology.slots_mask(level, res["vehicle_type"])
+    st.caption(f"{free.bit_count()} of {topology.capacity(level, res['vehicle_type'])} slots free for a {res['vehicle_type']}")
+    if not free and st.button("Find other times"):
+        # the time page shows a free-capacity timeline for this window
+        st.session_state.page = "reserve_time"
 
-    cols_per_row = 5
-    total = SLOTS_PER_LEVEL
-    for i in range(0, total, cols_per_row):
+    # only one page of slots is rendered, however big the level is
+    only_free = st.checkbox("Show free slots only", value=True)
+    slots = mask_slots(free) if only_free else range(1, topology.slot_count.get(level, 0) + 1)
+    page_size = SLOT_GRID_CONFIG["page_size"]
+    pages = max(1, math.ceil(len(slots) / page_size))
+    page = 1
+    if pages > 1:
+        page = int(st.number_input("Page", min_value=1, max_value=pages, value=1, step=1,
+                                   key=f"slot_page_{level}_{only_free}"))
+        st.caption(f"{len(slots)} slots on {pages} pages")
+    cols_per_row = SLOT_GRID_CONFIG["columns"]
+    shown = slots[(page - 1) * page_size:page * page_size]
+    for i in range(0, len(shown), cols_per_row):
         cols = st.columns(cols_per_row)
-        for j, col in enumerate(cols):
-            slot_no = i + j + 1
+        for col, slot_no in zip(cols, shown[i:i + cols_per_row]):
             key = f"slot_{level}_{slot_no}"
-            if slot_no in reserved:
+            bit = 1 << (slot_no - 1)
+            if not free & bit:
                 # dimmed - show disabled button
-                col.markdown(f"<button disabled style='opacity:0.5;padding:8px 12px'>Slot {slot_no} (Used)</button>", unsafe_allow_html=True)
+                label = "Used" if fits & bit else "Too small"
+                col.markdown(f"<button disabled style='opacity:0.5;padding:8px 12px'>Slot {slot_no} ({label})</button>", unsafe_allow_html=True)
             else:
                 if col.button(f"Slot {slot_no}", key=key):
                     st.session_state.reservation["slot_no"] = slot_no
@@ -487,6 +3571,31 @@ def choose_slot_page():
         st.session_state.page = "choose_level"
 
 # ---------- Confirm reservation ----------
+def book_reservation(r, level, slot_no):
+    """Claim the slot for the reservation in progress; remember the nearest alternative if it was taken."""
+    # compute bill but keep unpaid
+    amount, hours = compute_cost(r["vehicle_type"], r["entry_dt"], r["exit_dt"])
+    ok, reservation_id, alternative = claim_slot(st.session_state.user_id, level, slot_no, r["entry_dt"], r["exit_dt"], r["vehicle_type"], amount)
+    if ok:
+        r["level"], r["slot_no"] = level, slot_no
+        st.session_state.pop("slot_alternative", None)
+        st.success("Reservation created.")
+        st.session_state.page = "welcome"
+    else:
+        st.session_state.slot_alternative = alternative
+
+def book_any_slot(r):
+    """Let the allocator pick and book a slot for the reservation in progress."""
+    amount, hours = compute_cost(r["vehicle_type"], r["entry_dt"], r["exit_dt"])
+    ok, reservation_id, picked = allocate_slot(st.session_state.user_id, r["entry_dt"], r["exit_dt"], r["vehicle_type"], amount)
+    if ok:
+        r["level"], r["slot_no"] = picked
+        st.success(f"Reserved Level {picked[0]}, Slot {picked[1]}.")
+        st.session_state.page = "welcome"
+    else:
+        st.error("No suitable slot is free for this time.")
+
+@instrumented("page")
 def confirm_reservation_page():
     show_sidebar_user_info()
     r = st.session_state.get("reservation")
@@ -500,41 +3609,43 @@ def confirm_reservation_page():
     st.write(f"- Entry: {r['entry_dt'].strftime('%Y-%m-%d %H:%M')}")
     st.write(f"- Exit: {r['exit_dt'].strftime('%Y-%m-%d %H:%M')}")
     if st.button("Confirm Reservation"):
-        # compute bill but keep unpaid
-        amount, hours = compute_cost(r["vehicle_type"], r["entry_dt"], r["exit_dt"])
-        create_reservation_db(st.session_state.user_id, r["level"], r["slot_no"], r["entry_dt"], r["exit_dt"], r["vehicle_type"], amount)
-        st.success("Reservation created.")
-        st.session_state.page = "welcome"
+        book_reservation(r, r["level"], r["slot_no"])
+    if "slot_alternative" in st.session_state:
+        alternative = st.session_state.slot_alternative
+        if alternative:
+            st.error(f"Slot {r['slot_no']} on level {r['level']} was just taken. Nearest free slot: level {alternative[0]}, slot {alternative[1]}.")
+            if st.button(f"Book Level {alternative[0]} Slot {alternative[1]} instead"):
+                book_reservation(r, alternative[0], alternative[1])
+        else:
+            st.error("That slot was just taken and no other slot is free for this time.")
     if st.button("Back"):
+        st.session_state.pop("slot_alternative", None)
         st.session_state.page = "choose_slot"
 
 # ---------- Billing page ----------
+@instrumented("page")
 def bill_page():
     show_sidebar_user_info()
     user_id = st.session_state.get("user_id")
-    df = reservations_for_user(user_id)
     # If user selected a reservation via sidebar, use it
     selected = st.session_state.get("selected_reservation")
     if selected:
-        row = df[df["reservation_id"] == int(selected)]
-        if row.empty:
+        row = get_reservation(int(selected), user_id)
+        if not row:
             st.error("Selected reservation not found.")
             return
-        row = row.iloc[0]
     else:
-        pending = df[(df["paid"] == 0) & (df["status"] == "reserved")]
-        if pending.empty:
+        pending = pending_bills_for_user(user_id)
+        if not pending:
             st.info("No pending bills. Create a reservation first.")
             if st.button("Back to Welcome"):
                 st.session_state.page = "welcome"
             return
-        row = pending.iloc[0]
+        row = pending[0]
 
     st.header("Bill & Checkout")
     st.write(f"Reservation ID: {row['reservation_id']}")
-    entry = pd.to_datetime(row["entry_datetime"])
-    exit_ = pd.to_datetime(row["exit_datetime"])
-    amount, hours = compute_cost(row["vehicle_type"], entry, exit_)
+    amount, hours = compute_cost(row["vehicle_type"], row["entry_datetime"], row["exit_datetime"])
     st.write(f"Vehicle: {row['vehicle_type']}")
     st.write(f"Duration (rounded): {hours} hours")
     st.write(f"Amount Due: {amount:.2f}")
@@ -547,7 +3658,21 @@ def bill_page():
         if st.button("Back"):
             st.session_state.page = "welcome"
 
+    if not selected and len(pending) > 1:
+        st.subheader("Settle several bills")
+        by_id = {b["reservation_id"]: b for b in pending}
+        chosen = st.multiselect(
+            "Pending bills", list(by_id), default=list(by_id),
+            format_func=lambda rid: f"#{rid} — Level {by_id[rid]['level_no']} Slot {by_id[rid]['slot_no']}, "
+                                    f"{by_id[rid]['entry_datetime']:%Y-%m-%d %H:%M}, {by_id[rid]['amount']:.2f}")
+        total = sum(by_id[rid]["amount"] for rid in chosen)
+        st.write(f"Total for {len(chosen)} bills: {total:.2f}")
+        if st.button("Pay selected", disabled=not chosen):
+            st.session_state.current_bill = {"reservation_ids": [int(rid) for rid in chosen], "amount": float(total)}
+            st.session_state.page = "payment"
+
 # ---------- Payment page (simulated) ----------
+@instrumented("page")
 def payment_page():
     show_sidebar_user_info()
     bill = st.session_state.get("current_bill")
@@ -556,7 +3681,10 @@ def payment_page():
         st.session_state.page = "welcome"
         return
     st.header("Payment")
-    st.write(f"Paying Reservation ID {bill['reservation_id']} — Amount: {bill['amount']:.2f}")
+    if "reservation_ids" in bill:
+        st.write(f"Paying {len(bill['reservation_ids'])} reservations — Amount: {bill['amount']:.2f}")
+    else:
+        st.write(f"Paying Reservation ID {bill['reservation_id']} — Amount: {bill['amount']:.2f}")
     st.write("**Demo only**: This simulates payment. Do NOT enter real card details here in production.")
     with st.form("payment_form"):
         cc = st.text_input("Card Number (16 digits)", max_chars=16)
@@ -566,15 +3694,21 @@ def payment_page():
         if submitted:
             if len(cc) == 16 and len(cvv) in (3,4):
                 # simulated success
+                if "reservation_ids" in bill:
+                    settled, paid_at = settle_reservations(st.session_state.user_id, bill["reservation_ids"])
+                    if not settled:
+                        st.error("These bills have already been paid or cancelled.")
+                        st.session_state.pop("current_bill", None)
+                        return
+                    receipt = settlement_receipt_info(st.session_state.user_id, settled, paid_at)
+                else:
+                    if not mark_reservation_paid(bill["reservation_id"], bill["amount"]):
+                        st.error("This bill has already been paid or cancelled.")
+                        st.session_state.pop("current_bill", None)
+                        return
+                    # prepare receipt info
+                    receipt = receipt_info(bill["reservation_id"], st.session_state.user_id, bill["amount"], datetime.now())
                 st.success("Payment successful (simulated).")
-                mark_reservation_paid(bill["reservation_id"], bill["amount"])
-                # prepare receipt info
-                receipt = {
-                    "Reservation ID": bill["reservation_id"],
-                    "User": st.session_state.user_id,
-                    "Amount Paid": f"{bill['amount']:.2f}",
-                    "Paid At": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
                 st.session_state.receipt = receipt
                 st.session_state.page = "receipt"
             else:
@@ -583,6 +3717,7 @@ def payment_page():
         st.session_state.page = "bill"
 
 # ---------- Receipt ----------
+@instrumented("page")
 def receipt_page():
     show_sidebar_user_info()
     r = st.session_state.get("receipt")
@@ -593,20 +3728,29 @@ def receipt_page():
     st.header("Receipt")
     for k, v in r.items():
         st.write(f"**{k}:** {v}")
+    st.download_button("Download receipt", make_receipt_png(r), file_name="vpark_receipt.png", mime="image/png")
     if st.button("Back to Welcome"):
         st.session_state.page = "welcome"
 
 # ---------- Account history ----------
+@instrumented("page")
 def history_page():
     show_sidebar_user_info()
     user_id = st.session_state.get("user_id")
-    df = reservations_for_user(user_id)
+    # cursors of the pages above the current one (None = newest page)
+    cursors = st.session_state.setdefault("history_cursors", [None])
+    df, next_cursor = reservations_page_for_user(user_id, before=cursors[-1])
     st.header("Account History")
     
-    if df.empty:
+    if df.empty and len(cursors) == 1:
         st.info("No reservations yet.")
     else:
         st.dataframe(df)
+        c1, c2 = st.columns([1,1])
+        with c1:
+            st.button("← Newer", disabled=len(cursors) == 1, on_click=cursors.pop)
+        with c2:
+            st.button("Older →", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,))
         st.write("To cancel a future reservation, enter its Reservation ID below (0 = none).")
         
         # Allow 0 as default to avoid StreamlitValueBelowMinError
@@ -624,49 +3768,687 @@ def history_page():
         st.session_state.page = "welcome"
 
 
+# ---------- Operator occupancy dashboard ----------
+@instrumented("page")
+def operator_page():
+    show_sidebar_user_info()
+    if not is_operator(st.session_state.get("user_id")):
+        st.error("The occupancy dashboard is only available to operators.")
+        st.session_state.page = "welcome"
+        return
+    st.header("Occupancy by Level")
+    view = st.radio("Window", ["Next 24 hours", "Last 30 days"], horizontal=True)
+    now = datetime.now()
+    if view == "Next 24 hours":
+        df = occupancy_by_level(now, now + timedelta(hours=24))
+    else:
+        df = occupancy_by_level(now - timedelta(days=30), now)
+
+    current = df[df["hour_start"] == now.replace(minute=0, second=0, microsecond=0)]
+    if not current.empty:
+        cols = st.columns(len(current))
+        for col, (_, row) in zip(cols, current.iterrows()):
+            col.metric(f"Level {row['level_no']} now", f"{row['reserved']}/{row['capacity']}", f"{row['occupancy_pct']:.0f}%")
+    pct = df.pivot(index="hour_start", columns="level_no", values="occupancy_pct")
+    pct.columns = [f"Level {c}" for c in pct.columns]
+    st.line_chart(pct)
+    with st.expander("Hourly numbers"):
+        st.dataframe(df)
+    if st.button("Back to Welcome"):
+        st.session_state.page = "welcome"
+
+# ---------- Diagnostics (admin only) ----------
+def diagnostics_page():
+    show_sidebar_user_info()
+    if st.session_state.get("user_id") not in ADMIN_USERS:
+        st.error("Diagnostics are only available to administrators.")
+        st.session_state.page = "welcome"
+        return
+    st.header("Diagnostics")
+    if not PROFILE_ENABLED:
+        st.info("Profiling is off. Start the app with VPARK_PROFILE=1 to record calls, queries and timings.")
+    last = st.session_state.get("last_rerun_profile")
+    if last:
+        st.subheader(f"Previous rerun: {last['page']} — {last['wall_ms']:.1f} ms, {last['queries']} queries, {last['rows']} rows")
+        st.dataframe(pd.DataFrame([{"function": name, **c} for name, c in last["calls"].items()]))
+    totals = _profiler().totals()
+    if totals:
+        st.subheader("Since process start")
+        st.dataframe(pd.DataFrame([{"kind": k, "function": n, **v, "avg_ms": v["seconds"] / v["calls"] * 1000}
+                                   for (k, n), v in totals.items()]).sort_values("seconds", ascending=False))
+    st.subheader("Connection pool")
+    st.json(pool_stats())
+    if DB_REPLICAS:
+        st.subheader("Read replicas")
+        st.json(replica_stats())
+    st.subheader("User cache")
+    st.json(user_cache_stats())
+    st.subheader("Shared change log")
+    st.json(shared_cache_stats())
+    st.subheader("Lifecycle sweeper")
+    st.json(_sweep_stats().stats())
+    metrics = prometheus_metrics()
+    st.download_button("Download Prometheus metrics", metrics, file_name="vpark_metrics.prom", mime="text/plain")
+    with st.expander("Prometheus text"):
+        st.code(metrics)
+    if st.button("Back to Welcome"):
+        st.session_state.page = "welcome"
+
+
 # ===================== ROUTER / MAIN =====================
 def main():
     st.title("")
 
-    # initialize DB once
-    init_db()
+    # create/upgrade the schema once per process
+    _ensure_schema()
+    _start_archiver()
+    _start_sweeper()
+    # pick up bookings and profile changes made by other server processes
+    sync_shared_changes()
 
     # session defaults
     if "page" not in st.session_state:
         st.session_state.page = "home"
 
     page = st.session_state.page
+    profiler = _profiler() if PROFILE_ENABLED else None
+    if profiler:
+        profiler.begin_rerun()
+    try:
+        route(page)
+    finally:
+        if profiler:
+            st.session_state.last_rerun_profile = profiler.end_rerun(page)
 
-    if page == "home":
-        home_page()
-    elif page == "about":
-        about_page()
-    elif page == "signup":
-        signup_page()
-    elif page == "login":
-        login_page()
-    elif page == "welcome":
-        welcome_page()
-    elif page == "reserve_time":
-        reserve_time_page()
-    elif page == "choose_level":
-        choose_level_page()
-    elif page == "choose_slot":
-        choose_slot_page()
-    elif page == "confirm_reservation":
-        confirm_reservation_page()
-    elif page == "bill":
-        bill_page()
-    elif page == "payment":
-        payment_page()
-    elif page == "receipt":
-        receipt_page()
-    elif page == "history":
-        history_page()
-    else:
+# Page name (st.session_state.page) -> handler
+PAGES = {
+    "home": home_page,
+    "about": about_page,
+    "signup": signup_page,
+    "login": login_page,
+    "welcome": welcome_page,
+    "reserve_time": reserve_time_page,
+    "choose_level": choose_level_page,
+    "choose_slot": choose_slot_page,
+    "confirm_reservation": confirm_reservation_page,
+    "recurring": recurring_page,
+    "bill": bill_page,
+    "payment": payment_page,
+    "receipt": receipt_page,
+    "history": history_page,
+    "diagnostics": diagnostics_page,
+    "operator": operator_page
+}
+
+def route(page):
+    handler = PAGES.get(page)
+    if handler is None:
         st.session_state.page = "home"
-        home_page()
+        handler = home_page
+    handler()
+
+# ===================== CLI =====================
+# Maintenance commands: python VPARK_FINAL.py <command> [options]
+# (streamlit run VPARK_FINAL.py still starts the app)
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))]
+
+def cli_migrate(argv):
+    argparse.ArgumentParser(prog="VPARK_FINAL.py migrate", description="Apply pending schema migrations.").parse_args(argv)
+    applied = init_db()
+    print(f"Applied migrations: {applied}" if applied else "Schema already up to date.")
+    print(f"Schema version: {schema_version()}")
+    return 0
+
+def cli_check_plans(argv):
+    argparse.ArgumentParser(prog="VPARK_FINAL.py check-plans",
+                            description="Fail if a hot query's EXPLAIN plan falls back to a scan.").parse_args(argv)
+    problems = check_query_plans()
+    for p in problems:
+        print(f"FAIL {p}")
+    if problems:
+        return 1
+    print(f"OK: {len(HOT_QUERIES)} hot queries use indexes.")
+    return 0
+
+def cli_stress_claim(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py stress-claim",
+                                     description="Fire many simultaneous claims for one slot; exactly one must win.")
+    parser.add_argument("--claims", type=int, default=300, help="number of simultaneous claims")
+    parser.add_argument("--connections", type=int, default=50, help="connection pool size for the run")
+    parser.add_argument("--level", type=int, help="level to claim on (default: the lowest one)")
+    parser.add_argument("--slot", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ThreadPoolExecutor
+    DB_POOL_CONFIG.update(pool_size=args.connections, max_overflow=0, checkout_timeout=120.0)
+    init_db()
+    if args.level is None:
+        args.level = lot_topology().levels[0]
+    user_id = f"stress_{int(time.time())}"
+    ok, err = register_user(user_id, "Stress Test", "stress", "-", "STRESS", "0", "4 wheeler")
+    if not ok:
+        print(f"Could not create test user: {err}")
+        return 1
+    # a window far in the future that nobody else uses
+    entry_dt = datetime.now().replace(second=0, microsecond=0) + timedelta(days=3650)
+    exit_dt = entry_dt + timedelta(hours=2)
+    barrier = threading.Barrier(args.claims)
+
+    def one_claim(_):
+        barrier.wait()
+        return claim_slot(user_id, args.level, args.slot, entry_dt, exit_dt, "4 wheeler", 0.0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.claims) as pool:
+        results = list(pool.map(one_claim, range(args.claims)))
+    elapsed = time.perf_counter() - started
+
+    winners = [r for r in results if r[0]]
+    losers = [r for r in results if not r[0]]
+    bad_alternatives = [r for r in losers if r[2] == (args.level, args.slot)]
+    conn = get_db_conn()
+    cur = conn.cursor()
+    conn.start_transaction()
+    stored = delete_reservations(cur, "user_id=%s", (user_id,))
+    cur.execute("DELETE FROM user_details WHERE user_id=%s", (user_id,))
+    conn.commit()
+    cur.close()
+    conn.close()
+    for rid in stored:
+        _availability().remove(rid)
+
+    print(f"{args.claims} claims in {elapsed:.2f}s: {len(winners)} won, {len(losers)} lost, {len(stored)} rows stored")
+    if len(winners) != 1 or len(stored) != 1 or bad_alternatives:
+        print("FAIL: expected exactly one winner and alternatives that differ from the contested slot")
+        return 1
+    print("OK")
+    return 0
+
+def cli_bench_pricing(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py bench-pricing",
+                                     description="Throughput of compute_costs_bulk against the per-row compute_cost.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--check-rows", type=int, default=20_000, help="rows also priced one by one for comparison")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    types = np.array(["2 wheeler", "3 wheeler", "4 wheeler", "4 Wheeler (SUV)", "2-wheeler"], dtype=object)
+    start = np.datetime64("2030-01-01T00:00:00", "s")
+    entries = start + rng.integers(0, 30 * 24 * 3600, args.rows).astype("timedelta64[s]")
+    exits = entries + rng.integers(60, 48 * 3600, args.rows).astype("timedelta64[s]")
+    vehicle_types = types[rng.integers(0, len(types), args.rows)]
+
+    started = time.perf_counter()
+    amounts, hours = compute_costs_bulk(vehicle_types, entries, exits)
+    bulk_seconds = time.perf_counter() - started
+
+    n = min(args.check_rows, args.rows)
+    py_entries = pd.to_datetime(entries[:n]).to_pydatetime()
+    py_exits = pd.to_datetime(exits[:n]).to_pydatetime()
+    started = time.perf_counter()
+    expected = [compute_cost(vehicle_types[i], py_entries[i], py_exits[i]) for i in range(n)]
+    loop_seconds = time.perf_counter() - started
+    mismatches = sum(1 for i, (amt, hrs) in enumerate(expected) if amt != amounts[i] or hrs != hours[i])
+
+    print(f"bulk:     {args.rows:,} rows in {bulk_seconds:.3f}s ({args.rows / bulk_seconds:,.0f} rows/s)")
+    print(f"per-row:  {n:,} rows in {loop_seconds:.3f}s ({n / loop_seconds:,.0f} rows/s)")
+    print(f"mismatches against compute_cost: {mismatches}")
+    return 1 if mismatches else 0
+
+def cli_export_receipts(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py export-receipts",
+                                     description="Export receipts of reservations paid in a date range.")
+    parser.add_argument("--start", required=True, type=date.fromisoformat, help="first day (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=date.fromisoformat, help="last day, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=["zip", "pdf"], default="zip")
+    parser.add_argument("--out", help="output file (default receipts_<start>_<end>.<format>)")
+    parser.add_argument("--workers", type=int, default=RECEIPT_CONFIG["workers"])
+    parser.add_argument("--chunk-size", type=int, default=RECEIPT_CONFIG["chunk_size"])
+    args = parser.parse_args(argv)
+
+    out = args.out or f"receipts_{args.start}_{args.end}.{args.format}"
+    start_dt = datetime.combine(args.start, datetime.min.time())
+    end_dt = datetime.combine(args.end + timedelta(days=1), datetime.min.time())
+    started = time.perf_counter()
+    count = export_receipts(start_dt, end_dt, out, args.format, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {count} receipts to {out} in {elapsed:.1f}s")
+    return 0
+
+def cli_bench_auth(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py bench-auth",
+                                     description="Logins per second by bcrypt cost and worker count (no database needed).")
+    parser.add_argument("--costs", default="10,11,12", help="comma-separated bcrypt cost factors")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--logins", type=int, default=64, help="logins per measurement")
+    parser.add_argument("--sessions", type=int, default=32, help="concurrent simulated sessions")
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ThreadPoolExecutor
+    print(f"{'cost':>4} {'workers':>7} {'logins/s':>9} {'p95 ms':>8}")
+    for cost in [int(c) for c in args.costs.split(",")]:
+        hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(cost))
+        for workers in [int(w) for w in args.workers.split(",")]:
+            service = AuthService(bcrypt_rounds=cost, workers=workers, max_queue=args.logins)
+            latencies = []
+
+            def one_login(_):
+                t = time.perf_counter()
+                service.verify("correct horse", hashed)
+                latencies.append(time.perf_counter() - t)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.sessions) as sessions:
+                list(sessions.map(one_login, range(args.logins)))
+            elapsed = time.perf_counter() - started
+            p95 = percentile(sorted(latencies), 95) * 1000
+            print(f"{cost:>4} {workers:>7} {args.logins / elapsed:>9.1f} {p95:>8.1f}")
+            service._executor.shutdown()
+    return 0
+
+class FlowRecorder:
+    """Collects per-function latencies from many benchmark threads."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def call(self, name, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            with self._lock:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.samples.setdefault(name, []).append(elapsed)
+
+    def report(self, wall_seconds):
+        out = {}
+        for name, values in self.samples.items():
+            values = sorted(values)
+            out[name] = {
+                "calls": len(values),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "mean_ms": sum(values) / len(values) * 1000,
+                "throughput_per_s": len(values) / wall_seconds if wall_seconds else 0.0
+            }
+        return out
+
+def simulate_session(rec, user_id, bookings, rng):
+    """One user going through signup -> login -> reserve -> bill -> pay, `bookings` times."""
+    rec.call("register_user", register_user, user_id, "Bench User", "bench-password", "-", f"BENCH{rng.randint(0, 99999)}", "0000000000", "4 wheeler")
+    rec.call("authenticate_user", authenticate_user, user_id, "bench-password")
+    for _ in range(bookings):
+        # reserve_time_page
+        user = rec.call("get_user", get_user, user_id)
+        # far in the future so the benchmark never competes with real bookings
+        entry_dt = datetime(2099, 1, 1) + timedelta(days=rng.randint(0, 3000), hours=rng.randint(0, 23))
+        exit_dt = entry_dt + timedelta(hours=rng.randint(1, 6))
+        # choose_level_page / choose_slot_page
+        free = rec.call("free_slots_by_level", free_slots_by_level, entry_dt, exit_dt, user["vehicle_type"])
+        levels = [level for level in free if free[level]]
+        if not levels:
+            continue
+        level = rng.choice(levels)
+        slot_no = rng.choice(free[level])
+        # confirm_reservation_page
+        amount, hours = compute_cost(user["vehicle_type"], entry_dt, exit_dt)
+        ok, reservation_id, alternative = rec.call("claim_slot", claim_slot, user_id, level, slot_no, entry_dt, exit_dt, user["vehicle_type"], amount)
+        if not ok:
+            continue
+        # bill_page
+        rec.call("pending_bills_for_user", pending_bills_for_user, user_id)
+        # payment_page
+        rec.call("mark_reservation_paid", mark_reservation_paid, reservation_id, amount)
+    # history_page
+    rec.call("reservations_page_for_user", reservations_page_for_user, user_id)
+
+def cli_bench_flow(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py bench-flow",
+                                     description="Load-test the reservation flow with concurrent simulated sessions against the configured MySQL.")
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent simulated users")
+    parser.add_argument("--bookings", type=int, default=5, help="bookings per user")
+    parser.add_argument("--out", default="bench_flow.json", help="JSON results file")
+    parser.add_argument("--baseline", help="earlier results file; exit 1 if a p95 regressed beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated users and reservations")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args(argv)
+
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    init_db()
+    run_id = f"bench_{int(time.time())}"
+    rec = FlowRecorder()
+
+    def one_session(i):
+        simulate_session(rec, f"{run_id}_{i}", args.bookings, random.Random(args.seed + i))
+
+    started = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        for future in [pool.submit(one_session, i) for i in range(args.sessions)]:
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                print(f"session failed: {e}")
+    wall = time.perf_counter() - started
+
+    if not args.keep:
+        conn = get_db_conn()
+        cur = conn.cursor()
+        conn.start_transaction()
+        created = delete_reservations(cur, "user_id LIKE %s", (run_id + "\\_%",))
+        cur.execute("DELETE FROM user_details WHERE user_id LIKE %s", (run_id + "\\_%",))
+        conn.commit()
+        cur.close()
+        conn.close()
+        for rid in created:
+            _availability().remove(rid)
+
+    functions = rec.report(wall)
+    results = {
+        "run_id": run_id,
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "sessions": args.sessions,
+        "bookings_per_session": args.bookings,
+        "wall_seconds": wall,
+        "failed_sessions": failures,
+        "pool": pool_stats(),
+        "functions": functions
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+
+    print(f"{args.sessions} sessions in {wall:.1f}s ({failures} failed) -> {args.out}")
+    print(f"{'function':<28} {'calls':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'calls/s':>8}")
+    for name, r in functions.items():
+        print(f"{name:<28} {r['calls']:>6} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['throughput_per_s']:>8.1f}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["functions"]
+        for name, r in functions.items():
+            before = baseline.get(name)
+            if before and r["p95_ms"] > before["p95_ms"] * (1 + args.tolerance):
+                regressions.append(f"{name}: p95 {before['p95_ms']:.1f}ms -> {r['p95_ms']:.1f}ms")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+    return 1 if failures or regressions else 0
+
+def cli_import(argv, kind):
+    parser = argparse.ArgumentParser(prog=f"VPARK_FINAL.py import-{kind}",
+                                     description=f"Bulk-load {kind} from a CSV or Parquet file.")
+    parser.add_argument("path")
+    parser.add_argument("--batch-size", type=int, default=BULK_CONFIG["batch_size"])
+    if kind == "users":
+        parser.add_argument("--workers", type=int, default=BULK_CONFIG["hash_workers"], help="password hashing processes")
+        parser.add_argument("--rounds", type=int, default=AUTH_CONFIG["bcrypt_rounds"], help="bcrypt cost for plain-text passwords")
+        parser.add_argument("--skip-existing", action="store_true", help="ignore rows whose user_id already exists")
+    args = parser.parse_args(argv)
+    init_db()
+    started = time.perf_counter()
+    if kind == "users":
+        count = import_users(args.path, args.batch_size, args.workers, args.rounds, args.skip_existing)
+    else:
+        count = import_reservations(args.path, args.batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"Imported {count} {kind} in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)")
+    return 0
+
+def cli_export(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py export", description="Stream a table to CSV or Parquet.")
+    parser.add_argument("table", choices=sorted(EXPORT_QUERIES))
+    parser.add_argument("path", help="output .csv or .parquet file")
+    parser.add_argument("--batch-size", type=int, default=BULK_CONFIG["batch_size"])
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    count = export_table(args.table, args.path, args.batch_size)
+    print(f"Exported {count} {args.table} to {args.path} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+def cli_archive(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py archive",
+                                     description="Move finished reservations into reservations_archive (e.g. from cron).")
+    parser.add_argument("--keep-days", type=int, default=ARCHIVE_CONFIG["keep_days"])
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_CONFIG["batch_size"])
+    args = parser.parse_args(argv)
+    moved = archive_reservations(args.keep_days, args.batch_size)
+    if moved is None:
+        print("Another process is archiving right now; nothing done.")
+    else:
+        print(f"Archived {moved} reservations.")
+    return 0
+
+def cli_sweep(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py sweep",
+                                     description="Mark past-exit reservations completed (paid) or overdue (unpaid).")
+    parser.add_argument("--batch-size", type=int, default=SWEEP_CONFIG["batch_size"])
+    parser.add_argument("--grace-minutes", type=int, default=SWEEP_CONFIG["overdue_grace_minutes"])
+    args = parser.parse_args(argv)
+    counts = sweep_reservations(args.batch_size, args.grace_minutes)
+    if counts is None:
+        print("Another process is sweeping right now; nothing done.")
+    else:
+        print(f"Completed {counts['completed']}, overdue {counts['overdue']}.")
+    return 0
+
+# run in a fresh interpreter by bench-startup: import the app, render one page, report timings
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+app = __import__(sys.argv[2])
+imported = time.perf_counter()
+loaded_at_import = [m for m in app.HEAVY_MODULES if m in sys.modules]
+app.PAGES[sys.argv[3]]()
+rendered = time.perf_counter()
+print(json.dumps({"import_ms": (imported - started) * 1000, "first_render_ms": (rendered - imported) * 1000,
+                  "loaded_at_import": loaded_at_import,
+                  "loaded_after_render": [m for m in app.HEAVY_MODULES if m in sys.modules]}))
+"""
+
+def cli_bench_startup(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py bench-startup",
+                                     description="Time a cold import of the app and the first render of a page in fresh interpreters.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to start")
+    parser.add_argument("--page", default="home", choices=["home", "about", "signup", "login"],
+                        help="page to render first (pages that need no login or database)")
+    parser.add_argument("--out", default="bench_startup.json", help="JSON results file")
+    parser.add_argument("--baseline", help="earlier results file; exit 1 if a p50 regressed beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 slowdown vs baseline (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    import subprocess
+    app_dir, app_file = os.path.split(os.path.abspath(__file__))
+    runs = []
+    for _ in range(args.runs):
+        proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, app_dir, os.path.splitext(app_file)[0], args.page],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr)
+            return 1
+        runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    summary = {}
+    for field in ("import_ms", "first_render_ms"):
+        values = sorted(r[field] for r in runs)
+        summary[field] = {"p50": percentile(values, 50), "max": values[-1]}
+    results = {
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+        "page": args.page,
+        "runs": runs,
+        "summary": summary
+    }
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{args.runs} cold starts, first page '{args.page}' -> {args.out}")
+    for field, r in summary.items():
+        print(f"{field:<16} p50 {r['p50']:>8.1f}  max {r['max']:>8.1f}")
+    print(f"heavy modules loaded at import: {', '.join(runs[-1]['loaded_at_import']) or 'none'}; "
+          f"after first render: {', '.join(runs[-1]['loaded_after_render']) or 'none'}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["summary"]
+        for field, r in summary.items():
+            before = baseline.get(field)
+            if before and r["p50"] > before["p50"] * (1 + args.tolerance):
+                regressions.append(f"{field}: p50 {before['p50']:.1f}ms -> {r['p50']:.1f}ms")
+        for line in regressions:
+            print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+def cli_gate_server(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py gate-server",
+                                     description="Serve the gate check-in/check-out HTTP API.")
+    parser.add_argument("--host", default=GATE_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=GATE_CONFIG["port"])
+    args = parser.parse_args(argv)
+    server = make_gate_server(args.host, args.port)
+    print(f"Gate API on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def cli_bench_gate(argv):
+    parser = argparse.ArgumentParser(prog="VPARK_FINAL.py bench-gate",
+                                     description="Requests per second per gate: check every test vehicle in and out over HTTP.")
+    parser.add_argument("--gates", type=int, default=4, help="gates sending requests at the same time")
+    parser.add_argument("--vehicles", type=int, default=200, help="test vehicles per gate")
+    parser.add_argument("--keep", action="store_true", help="keep the generated users and reservations")
+    args = parser.parse_args(argv)
+
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+    init_db()
+    run_id = f"gate_{int(time.time())}"
+    topology = lot_topology()
+    slots = [(level, slot) for level in topology.levels for slot in mask_slots(topology.slots_mask(level, "4 wheeler"))]
+    if args.gates * args.vehicles > len(slots):
+        parser.error(f"at most {len(slots)} vehicles in total: every one needs its own slot")
+    # the in-process gates run on a clock far in the future, so the test bookings never
+    # compete with real ones for a slot
+    bench_now = (datetime.now() + timedelta(days=365 * 50)).replace(minute=0, second=0, microsecond=0)
+    entry_dt, exit_dt = bench_now - timedelta(minutes=5), bench_now + timedelta(hours=2)
+    hashed = hash_password("gate-bench")
+    users = [(f"{run_id}_{g}_{v}", "Gate Bench", hashed, "-", f"{run_id}{g}X{v}", "0", "4 wheeler")
+             for g in range(args.gates) for v in range(args.vehicles)]
+    conn = get_db_conn()
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO user_details (user_id,user_name,user_password,user_addr,vehicle_no,user_mobile_no,vehicle_type) "
+                    "VALUES (%s,%s,%s,%s,%s,%s,%s)", users)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    server = None
+    try:
+        for (user_id, *_), (level, slot) in zip(users, slots):
+            # through claim_slot: overlap check, occupancy, availability index and change log
+            ok, _, _ = claim_slot(user_id, level, slot, entry_dt, exit_dt, "4 wheeler")
+            if not ok:
+                raise RuntimeError(f"could not book Level {level}, Slot {slot} for the benchmark")
+        token = GATE_CONFIG["secret"] or secrets.token_hex(16)
+        GATE_CONFIG["secret"] = token
+        server = make_gate_server("127.0.0.1", 0, clock=lambda: bench_now)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+        rec = FlowRecorder()
+
+        def post(http, path, vehicle_no):
+            body = json.dumps({"vehicle_no": vehicle_no})
+            http.request("POST", path, body=body, headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"})
+            response = http.getresponse()
+            response.read()
+            if response.status != 200:
+                raise RuntimeError(f"{path} -> {response.status}")
+
+        def one_gate(g):
+            gate_conn = http.client.HTTPConnection(host, port, timeout=10)
+            for v in range(args.vehicles):
+                plate = f"{run_id}{g}X{v}"
+                rec.call(f"gate-{g} check-in", post, gate_conn, f"/gates/gate-{g}/check-in", plate)
+                rec.call(f"gate-{g} check-out", post, gate_conn, f"/gates/gate-{g}/check-out", plate)
+            gate_conn.close()
+
+        started = time.perf_counter()
+        failures = 0
+        with ThreadPoolExecutor(max_workers=args.gates) as pool:
+            for future in [pool.submit(one_gate, g) for g in range(args.gates)]:
+                try:
+                    future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f"gate failed: {e}")
+        wall = time.perf_counter() - started
+    finally:
+        # also after a failure or Ctrl-C
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if not args.keep:
+            conn = get_db_conn()
+            cur = conn.cursor()
+            conn.start_transaction()
+            created = delete_reservations(cur, "user_id LIKE %s", (run_id + "\\_%",))
+            cur.execute("DELETE FROM user_details WHERE user_id LIKE %s", (run_id + "\\_%",))
+            conn.commit()
+            cur.close()
+            conn.close()
+            index = _availability()
+            for rid in created:
+                index.remove(rid)
+            if created:
+                publish_change("status", reservation_ids=created, status="cancelled")
+
+    functions = rec.report(wall)
+    print(f"{args.gates} gates x {args.vehicles} vehicles in {wall:.1f}s ({failures} failed)")
+    print(f"{'gate / endpoint':<24} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in sorted(functions.items()):
+        print(f"{name:<24} {r['calls']:>8} {r['throughput_per_s']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    return 1 if failures else 0
+
+CLI_COMMANDS = {
+    "migrate": cli_migrate,
+    "check-plans": cli_check_plans,
+    "stress-claim": cli_stress_claim,
+    "bench-pricing": cli_bench_pricing,
+    "export-receipts": cli_export_receipts,
+    "bench-auth": cli_bench_auth,
+    "bench-flow": cli_bench_flow,
+    "import-users": lambda argv: cli_import(argv, "users"),
+    "import-reservations": lambda argv: cli_import(argv, "reservations"),
+    "export": cli_export,
+    "archive": cli_archive,
+    "sweep": cli_sweep,
+    "bench-startup": cli_bench_startup,
+    "gate-server": cli_gate_server,
+    "bench-gate": cli_bench_gate
+}
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
     main()
 #End of code
\ No newline at end of file